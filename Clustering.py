@@ -1,53 +1,48 @@
-import math
-
-from sklearn.cluster import KMeans
 import pandas as pd
-import matplotlib.pyplot as plt
-
-
-def get_partitions(km_obj: KMeans, feature: pd.Series):
-    # a map from feature value to cluster label
-    value_label_pairs = zip(feature, km_obj.labels_)
-    cluster_map = {val: cluster_label for val, cluster_label in value_label_pairs}
-
-    # now we use the map to assign each value to its cluster in a list called 'clusters'
-    clusters = [list() for _ in range(km_obj.n_clusters)]
-    for i in range(len(feature)):
-        val = feature.iloc[i]
-        cluster_label = cluster_map[val]
-        clusters[cluster_label].append(val)
-
-    return [min(cluster) for cluster in clusters]
-
-
-df = pd.read_csv('ACST_Cust_Sum.csv')
-
-# cluster TWA
-congregant_users = df.loc[:, 'CongregantUsers']
-congregant_users = congregant_users.loc[~congregant_users.map(math.isnan)]
-feat = congregant_users.to_numpy().reshape(-1, 1)
-kmeans_kwargs = {
-    "init": "random",
-    "n_init": 10,
-    "max_iter": 300,
-    "random_state": None
-}
-
-kmeans = KMeans(n_clusters=4, **kmeans_kwargs)
-kmeans.fit(feat)
-print(get_partitions(kmeans, congregant_users))
-
-
-sse = []
-for k in range(1, 11):
-    kmeans = KMeans(n_clusters=k, **kmeans_kwargs)
-    kmeans.fit(feat)
-    sse.append(kmeans.inertia_)
-
-plt.style.use("fivethirtyeight")
-plt.plot(range(1, 11), sse)
-plt.xticks(range(1, 11))
-plt.xlabel("Number of Clusters")
-plt.ylabel("SSE")
-plt.title('CongregantUsers')
-plt.show()
+
+from binning import OptimalClusters, bin_columns, save_cutpoints
+
+MAX_K = 10
+DATA_PATH = 'ACST_Cust_Sum.csv'
+#  The numeric columns to bin, their <column>_grouped variables are made by load_compact(..., cutpoints=...).
+COLUMNS = ['CongregantUsers']
+CUTPOINTS_PATH = 'cutpoints.json'
+
+
+def cluster_columns(data_path=DATA_PATH, columns=COLUMNS, max_k=MAX_K, cutpoints_path=CUTPOINTS_PATH, plot=True):
+    """
+    Bins every column of 'columns' of the file at 'data_path', saves the cutpoints to 'cutpoints_path' and
+    returns the binning (see binning.bin_columns).  With 'plot' the SSE of every k is plotted for each column,
+    which is the only use of matplotlib, so it is only imported then.
+    """
+    df = pd.read_csv(data_path, usecols=columns)
+
+    '''
+    The optimal 1-D k-means is computed exactly (see binning.py) instead of with randomly initialized KMeans, and a
+    single pass gives the SSE of every k from 1 to max_k for the elbow plot.  The cutpoints are the smallest value
+    of each cluster.  Every column is binned, in parallel, with the k at the elbow of its SSE curve.
+    '''
+    binning = bin_columns(df, columns, max_k, n_jobs=len(columns))
+    save_cutpoints(cutpoints_path, binning)
+    for column, entry in binning.items():
+        print(f'{column} : k = {entry["k"]}, cutpoints = {entry["cutpoints"]}')
+
+    if plot:
+        import matplotlib.pyplot as plt
+
+        plt.style.use("fivethirtyeight")
+        for column, entry in binning.items():
+            plt.figure()
+            plt.plot(range(1, max_k + 1), entry['sse'])
+            plt.xticks(range(1, max_k + 1))
+            plt.xlabel("Number of Clusters")
+            plt.ylabel("SSE")
+            plt.title(column)
+        plt.show()
+    return binning
+
+
+if __name__ == '__main__':
+    congregant_users = OptimalClusters(pd.read_csv(DATA_PATH, usecols=['CongregantUsers'])['CongregantUsers'], MAX_K)
+    print(congregant_users.cutpoints(4))
+    cluster_columns()
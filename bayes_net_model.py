@@ -7,15 +7,24 @@ Last Update  :    June 16, 2022
 from pgmpy.models import BayesianNetwork
 from pgmpy.factors.discrete.CPD import TabularCPD
 from cpdmaker import make_cpd
+from cpdmaker import cpd_from_counts
+from instrumentation import timer
+from sufficient_stats import encode_columns, fold_family_counts, fold_ids_from_indexes, training_cpds, \
+    stream_family_counts
 
 
-def make_bn(training_group, edges: list):
+def network_structure(edges: list):
     #  This line gives us a list of all the nodes in the network.
-
     nodes = list({edges[i][j] for i in range(len(edges)) for j in range(len(edges[i]))})
 
     #  The ith set in parents_of_node contains the elements that have a directed edge to the ith element in nodes
     parents_of_node = [sorted([edges[i][0] for i in range(len(edges)) if edges[i][1] == node]) for node in nodes]
+    return nodes, parents_of_node
+
+
+def make_bn(training_group, edges: list, backend='pandas', pseudocount=0):
+    #  'backend' and 'pseudocount' are passed through to make_cpd.
+    nodes, parents_of_node = network_structure(edges)
 
     #  The ith element of 'target_and_givens' is the list of target and given variables for the ith node.
     target_and_givens = [[node] + parents for node, parents in zip(nodes, parents_of_node)]
@@ -31,7 +40,67 @@ def make_bn(training_group, edges: list):
         bn.add_cpds(
             TabularCPD(nodes[i],
                        cardinalities[i],
-                       values=make_cpd(training_group, *target_and_givens[i]),
+                       values=make_cpd(training_group, *target_and_givens[i],
+                                       backend=backend, pseudocount=pseudocount),
                        evidence=parents_of_node[i],
                        evidence_card=parent_cards[i]))
     return bn
+
+
+def bn_from_cpds(edges: list, nodes: list, parents_of_node: list, cardinalities: dict, cpds: list):
+    #  Assembles a BayesianNetwork from already computed CPTs, cpds[i] being the table of nodes[i].
+    bn = BayesianNetwork(edges)
+    for i in range(len(nodes)):
+        bn.add_cpds(
+            TabularCPD(nodes[i],
+                       cardinalities[nodes[i]],
+                       values=cpds[i],
+                       evidence=parents_of_node[i],
+                       evidence_card=[cardinalities[parent] for parent in parents_of_node[i]]))
+    return bn
+
+
+def make_kfold_bns(data_frame, edges: list, test_grp_indexes, pseudocount=0, instruments=None):
+    """
+    Returns one BayesianNetwork per test group, trained on the rows of every other test group.
+    This is equivalent to calling make_bn once per training group, but the data is only counted
+    once (see sufficient_stats.py).  The states of every node are taken from the whole of
+    'data_frame', which keeps the CPT indexes consistent with 'environment_map' in every fold.
+    'pseudocount' is the Dirichlet smoothing described in make_cpd, 'instruments' an optional
+    Instrumentation (see instrumentation.py).
+    """
+    fold_ids = fold_ids_from_indexes(test_grp_indexes, len(data_frame))
+    return make_bns_from_fold_ids(data_frame, edges, fold_ids, len(test_grp_indexes), pseudocount, instruments)
+
+
+def make_bns_from_fold_ids(data_frame, edges: list, fold_ids, k, pseudocount=0, instruments=None):
+    #  make_kfold_bns for a split given as a fold id vector (see splitter.py), rows with a negative id are not used.
+    nodes, parents_of_node = network_structure(edges)
+    codes, states = encode_columns(data_frame, nodes)
+    cardinalities = {node: len(states[node]) for node in nodes}
+    family_counts = fold_family_counts(codes, states, nodes, parents_of_node, fold_ids, k, instruments)
+
+    bns = []
+    for i in range(k):
+        with timer(instruments, 'cpt_derivation'):
+            bns.append(bn_from_cpds(edges, nodes, parents_of_node, cardinalities,
+                                    training_cpds(family_counts, i, pseudocount)))
+    return bns
+
+
+def make_bns_from_file(path, edges: list, fold_column=None, row_filter=None, pseudocount=0):
+    """
+    Trains networks from a .csv or .parquet file too large to load, see stream_family_counts.  With a
+    'fold_column' this returns one network per fold, trained on the rows of every other fold, like
+    make_kfold_bns.  Without one it returns a single network trained on every row.  The sorted states
+    of every node are returned as well, as (bayesian_networks, states).
+    """
+    nodes, parents_of_node = network_structure(edges)
+    states, family_counts = stream_family_counts(path, nodes, parents_of_node, fold_column, row_filter)
+    cardinalities = {node: len(states[node]) for node in nodes}
+    if fold_column is None:
+        cpds = [cpd_from_counts(counts[0], pseudocount) for counts in family_counts]
+        return [bn_from_cpds(edges, nodes, parents_of_node, cardinalities, cpds)], states
+    num_folds = family_counts[0].shape[0]
+    return [bn_from_cpds(edges, nodes, parents_of_node, cardinalities, training_cpds(family_counts, i, pseudocount))
+            for i in range(num_folds)], states
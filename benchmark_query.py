@@ -0,0 +1,66 @@
+"""
+Compares the inference methods of fast_query on the same network and testing group.
+
+The posteriors of every method are checked against the original 'deepcopy' method (the
+script exits with an error if they differ) and the number of queries per second of each
+method is printed.  Without a csv the data is synthetic (see benchmarks/synthetic.py), which
+is also what test_benchmark_query.py checks.
+
+usage : python benchmark_query.py [path to csv or 'synthetic'] [number of test rows]
+"""
+import sys
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from bayes_net_model import make_bn
+from benchmarks.synthetic import generate
+from optimized_query import fast_query
+
+TARGET_VARIABLE = 'Satisfied'
+EDGES = [('Var1', TARGET_VARIABLE),
+         ('Var2', TARGET_VARIABLE),
+         ('MissingValues', TARGET_VARIABLE),
+         ('Product', TARGET_VARIABLE),
+         (TARGET_VARIABLE, 'Var3_grouped'),
+         (TARGET_VARIABLE, 'Var4_grouped'),
+         (TARGET_VARIABLE, 'BinVar1'),
+         (TARGET_VARIABLE, 'BinVar2'),
+         (TARGET_VARIABLE, 'BinVar3')]
+METHODS = ['deepcopy', 'stateless', 'compiled', 'markov_blanket', 'planner']
+
+
+def run_benchmark(data_frame, num_test_rows, methods=METHODS):
+    #  Returns the posteriors of every method in 'methods', in test row order.
+    bn = make_bn(data_frame, EDGES, backend='numpy')
+    environment_variables = [variable for variable in bn]
+    environment_variables.remove(TARGET_VARIABLE)
+    test_grp_indexes = [np.arange(min(num_test_rows, len(data_frame)))]
+
+    results = {}
+    for method in methods:
+        start = time()
+        fq, num_queries, _, _ = fast_query([bn], test_grp_indexes, environment_variables,
+                                           data_frame, TARGET_VARIABLE, method=method)
+        elapsed = time() - start
+        results[method] = fq[0]['0_y'].to_numpy(dtype=float)
+        print(f'{method:>10} : {num_queries} queries in {round(elapsed, 3)} s'
+              f'  ({round(num_queries / elapsed, 1)} queries/s)')
+    return results
+
+
+def differing_methods(results):
+    #  The methods whose posteriors differ from those of the first method of 'results'.
+    reference, *others = results
+    return [method for method in others if not np.allclose(results[method], results[reference])]
+
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else 'synthetic'
+    num_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    data = generate(num_rows) if csv_path == 'synthetic' else pd.read_csv(csv_path)
+    differing = differing_methods(run_benchmark(data, num_rows))
+    if differing:
+        sys.exit(f'{", ".join(differing)} posteriors differ from {METHODS[0]}')
+    print('Posteriors are unchanged.')
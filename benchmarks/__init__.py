@@ -0,0 +1,11 @@
+"""
+Benchmarks of the stages of the pipeline on synthetic customer data.
+
+    synthetic.py        -   The data generator.
+    run.py              -   Times every stage and appends the results to a JSON history, comparing
+                            them with the last run of the same settings:
+
+                                python -m benchmarks.run --rows 100000
+
+Run from the repository root, the modules of the pipeline are imported by name.
+"""
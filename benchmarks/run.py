@@ -0,0 +1,159 @@
+"""
+Times the stages of the pipeline on synthetic data and records the results over time.
+
+Every stage is run once untimed, to warm caches and imports, then 'repeats' times, and its best and
+median wall clock times are kept.  A run is appended to the history file as one JSON record, and its
+stages are compared with those of the last recorded run with the same settings: a stage whose best time grew by more than 'tolerance' is
+reported as a regression (and the exit status is 1 with --fail-on-regression).
+
+usage : python -m benchmarks.run [--rows N] [--repeats R] [--history path] [--methods stateless compiled ...]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from bayes_net_model import make_bn
+from benchmarks.synthetic import DEFAULT_EDGES, TARGET_VARIABLE, generate, write
+from cpdmaker import make_cpd
+from data_loader import load_compact
+from get_client_spreadsheet import return_client_csv
+from optimized_query import fast_query
+from scoring import score_test_group, risk_group
+
+DEFAULT_HISTORY = os.path.join(os.path.dirname(__file__), 'history.json')
+DEFAULT_TOLERANCE = 1.25
+
+
+def time_stage(function, repeats):
+    #  Runs 'function' once to warm up, then 'repeats' times, and returns (its last result, the list of wall clock times).
+    times = []
+    result = function()
+    for _ in range(repeats):
+        start = perf_counter()
+        result = function()
+        times.append(perf_counter() - start)
+    return result, times
+
+
+def run_stages(num_rows, repeats=3, seed=0, methods=('stateless', 'compiled', 'planner'), missing_rate=.05):
+    """
+    Returns a dict mapping the name of every stage to its timings.  The stages follow the
+    pipeline: loading the data file, building the target's CPT and the network with both backends,
+    querying the network with every method, scoring and writing the risk spreadsheets.
+    """
+    edges = DEFAULT_EDGES
+    nodes = list(dict.fromkeys(node for edge in edges for node in edge))
+    target_parents = sorted(parent for parent, child in edges if child == TARGET_VARIABLE)
+    stages = {}
+
+    def record(name, function):
+        result, times = time_stage(function, repeats)
+        stages[name] = {'best_seconds': min(times),
+                        'median_seconds': median(times),
+                        'rows_per_second': num_rows / min(times) if min(times) else None}
+        print(f'{name:>28} : {min(times):.4f} s best, {median(times):.4f} s median')
+        return result
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'synthetic.csv')
+        write(path, num_rows, seed=seed, missing_rate=missing_rate)
+        df, _ = record('load_compact', lambda: load_compact(path, nodes))
+    raw = generate(num_rows, seed=seed, missing_rate=missing_rate)
+
+    for backend in ('pandas', 'numpy'):
+        record(f'make_cpd[{backend}]', lambda: make_cpd(raw, TARGET_VARIABLE, *target_parents, backend=backend))
+        bn = record(f'make_bn[{backend}]', lambda: make_bn(raw, edges, backend=backend))
+
+    environment_variables = [variable for variable in bn.nodes if variable != TARGET_VARIABLE]
+    index = [np.arange(num_rows)]
+    fq = None
+    for method in methods:
+        fq = record(f'fast_query[{method}]',
+                    lambda: fast_query([bn], index, environment_variables, df, TARGET_VARIABLE,
+                                       method=method, show_progress=False))[0]
+
+    scores = record('score_test_group', lambda: score_test_group(df, fq[0], environment_variables, TARGET_VARIABLE))
+    high_risk_group = risk_group(scores, 'high_risk')
+    moderate_risk_group = risk_group(scores, 'moderate_risk')
+    with tempfile.TemporaryDirectory() as directory:
+        record('return_client_csv', lambda: return_client_csv(high_risk_group, moderate_risk_group, df,
+                                                              parent_directory=directory))
+    return stages
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(stages, previous, tolerance=DEFAULT_TOLERANCE):
+    #  Prints the ratio of every stage's best time to the previous run's and returns the names of the regressions.
+    regressions = []
+    for name, timing in stages.items():
+        if name not in previous:
+            continue
+        ratio = timing['best_seconds'] / previous[name]['best_seconds']
+        flag = ''
+        if ratio > tolerance:
+            regressions.append(name)
+            flag = '   <- REGRESSION'
+        print(f'{name:>28} : {ratio:.2f}x the previous run{flag}')
+    return regressions
+
+
+def _commit():
+    #  The current git commit, if the benchmark runs inside the repository.
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the stages of the pipeline on synthetic data.')
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--missing-rate', type=float, default=.05)
+    parser.add_argument('--methods', nargs='+', default=['stateless', 'compiled', 'planner'],
+                        help="the fast_query methods to time, 'deepcopy' is very slow")
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help='the JSON file the results are appended to')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='the slowdown ratio above which a stage is reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    arguments = parser.parse_args()
+
+    settings = {'rows': arguments.rows, 'repeats': arguments.repeats, 'seed': arguments.seed,
+                'missing_rate': arguments.missing_rate, 'methods': arguments.methods}
+    stage_timings = run_stages(arguments.rows, arguments.repeats, arguments.seed, arguments.methods,
+                               arguments.missing_rate)
+
+    history = load_history(arguments.history)
+    previous_runs = [run for run in history if run['settings'] == settings]
+    regressed = compare(stage_timings, previous_runs[-1]['stages'], arguments.tolerance) if previous_runs else []
+
+    history.append({'timestamp': datetime.now().isoformat(timespec='seconds'),
+                    'commit': _commit(),
+                    'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'pandas': pd.__version__,
+                    'settings': settings,
+                    'stages': stage_timings})
+    with open(arguments.history, 'w') as history_file:
+        json.dump(history, history_file, indent=2)
+
+    if regressed and arguments.fail_on_regression:
+        sys.exit(f'Regressions : {", ".join(regressed)}')
@@ -0,0 +1,126 @@
+"""
+A generator of synthetic customer data with the schema the scripts expect.
+
+Rows are sampled from a random Bayesian network over the given DAG (ancestral sampling with
+Dirichlet distributed CPTs), so the variables are as dependent as the network says and the
+queries, CPTs and risk groups computed from them look like those of the real data.  Values are
+then hidden as 'N' at random, and MissingValues counts the hidden values of each row.
+
+Variables are typed by name like the real columns: the target and BinVar* are booleans, Product
+and Var* take letter states, *_grouped take states g1, g2, ... and MissingValues is an integer.
+"""
+import string
+
+import numpy as np
+import pandas as pd
+
+TARGET_VARIABLE = 'Satisfied'
+DEFAULT_EDGES = [('Var1', TARGET_VARIABLE),
+                 ('Var2', TARGET_VARIABLE),
+                 ('MissingValues', TARGET_VARIABLE),
+                 ('Product', TARGET_VARIABLE),
+                 (TARGET_VARIABLE, 'Var3_grouped'),
+                 (TARGET_VARIABLE, 'Var4_grouped'),
+                 (TARGET_VARIABLE, 'BinVar1'),
+                 (TARGET_VARIABLE, 'BinVar2'),
+                 (TARGET_VARIABLE, 'BinVar3')]
+DEFAULT_CARDINALITIES = {'Product': 4, 'Var': 5, '_grouped': 4}
+
+
+def generate(num_rows, edges=DEFAULT_EDGES, cardinalities=None, missing_rate=.05, concentration=1.0, seed=0,
+             target=TARGET_VARIABLE):
+    """                                 FUNCTION generate
+       __________________________________________________________________________________________
+         Returns a DataFrame with an ID column, a MissingValues column and one column per node
+         of 'edges'.
+
+         cardinalities      -   Maps a variable name, or a name prefix or suffix ('Var',
+                                '_grouped', 'Product'), to its number of states.  Defaults to
+                                DEFAULT_CARDINALITIES.  Booleans always have 2 states.
+         missing_rate       -   The probability that a value of a variable other than the
+                                target, MissingValues and the binary variables is 'N'.
+         concentration      -   The Dirichlet parameter of every CPT column.  Small values give
+                                nearly deterministic CPTs, large values nearly uniform ones.
+         seed               -   The seed of the generator, the same seed gives the same data.
+       __________________________________________________________________________________________"""
+    rng = np.random.default_rng(seed)
+    cardinalities = {**DEFAULT_CARDINALITIES, **(cardinalities or {})}
+    nodes = list(dict.fromkeys(node for edge in edges for node in edge))
+    parents = {node: sorted(parent for parent, child in edges if child == node) for node in nodes}
+    observable = [node for node in nodes if node not in ('MissingValues', target) and not _is_boolean(node, target)]
+
+    #  Which values are hidden is decided first, so that MissingValues can be sampled as a parent like any other node.
+    hidden = {node: rng.random(num_rows) < missing_rate for node in observable}
+    missing_values = np.sum([hidden[node] for node in observable], axis=0, dtype=np.int64) \
+        if observable else np.zeros(num_rows, dtype=np.int64)
+
+    codes = {}
+    states = {}
+    for node in _topological_order(nodes, parents):
+        if node == 'MissingValues':
+            codes[node] = missing_values
+            states[node] = np.arange(len(observable) + 1)
+            continue
+        states[node] = _states(node, target, cardinalities)
+        codes[node] = _sample_node(rng, num_rows, len(states[node]), [codes[parent] for parent in parents[node]],
+                                   [len(states[parent]) for parent in parents[node]], concentration)
+
+    columns = {'ID': np.arange(num_rows), 'MissingValues': missing_values}
+    for node in nodes:
+        values = np.asarray(states[node])[codes[node]]
+        if node in hidden:
+            values = np.where(hidden[node], 'N', values).astype(object)
+        columns[node] = values
+    return pd.DataFrame(columns)
+
+
+def write(path, num_rows, **kwargs):
+    #  Writes generate(num_rows, **kwargs) to 'path' as a .csv or, if it ends with .parquet, a Parquet file.
+    data_frame = generate(num_rows, **kwargs)
+    if str(path).endswith('.parquet'):
+        data_frame.to_parquet(path, index=False)
+    else:
+        data_frame.to_csv(path, index=False)
+    return data_frame
+
+
+def _is_boolean(node, target):
+    return node == target or node.startswith('BinVar')
+
+
+def _states(node, target, cardinalities):
+    #  The state names of 'node', typed like the real column of the same name.
+    if _is_boolean(node, target):
+        return np.array([False, True])
+    if node in cardinalities:
+        cardinality = cardinalities[node]
+    else:
+        #  Suffixes are more specific than prefixes, Var3_grouped is a grouped variable.
+        matches = [value for name, value in cardinalities.items() if node.endswith(name)] + \
+                  [value for name, value in cardinalities.items() if node.startswith(name)]
+        cardinality = matches[0] if matches else 3
+    if node.endswith('_grouped'):
+        return np.array([f'g{i + 1}' for i in range(cardinality)])
+    return np.array(list(string.ascii_lowercase[:cardinality]))
+
+
+def _sample_node(rng, num_rows, cardinality, parent_codes, parent_cards, concentration):
+    #  Draws one state per row from a random CPT, given the states of the parents of every row.
+    num_configurations = int(np.prod(parent_cards)) if parent_cards else 1
+    cpt = rng.dirichlet(np.full(cardinality, concentration), size=num_configurations)
+    configuration = np.ravel_multi_index(tuple(parent_codes), tuple(parent_cards)) if parent_codes \
+        else np.zeros(num_rows, dtype=np.int64)
+    cumulative = np.cumsum(cpt, axis=1)[configuration]
+    return np.minimum((rng.random(num_rows)[:, None] > cumulative).sum(axis=1), cardinality - 1)
+
+
+def _topological_order(nodes, parents):
+    order = []
+    placed = set()
+    while len(order) < len(nodes):
+        ready = [node for node in nodes if node not in placed and all(parent in placed for parent in parents[node])]
+        if not ready:
+            raise ValueError('The edges contain a cycle')
+        order.extend(ready)
+        placed.update(ready)
+    return order
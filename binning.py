@@ -0,0 +1,165 @@
+"""
+Exact 1-D k-means for binning numeric columns into the *_grouped variables of the network.
+
+In one dimension the clusters of an optimal k-means are intervals of the sorted values, so the
+optimal clustering can be computed exactly by dynamic programming over the sorted distinct values
+(the Ckmeans.1d.dp algorithm).  One pass for k = max_k also gives the optimal SSE of every smaller k,
+which is all the elbow plot needs.  The minimum of the DP over the previous cluster's end is
+monotone in the current cluster's end, so every k costs O(n log n) with divide and conquer, n being
+the number of distinct values.
+
+A binning is saved as JSON mapping every column to its cutpoints, the smallest value of each cluster.
+data_loader.load_compact takes these cutpoints to create the <column>_grouped variables as it reads.
+"""
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+#  The state of a value that is missing in the source column, as in the rest of the data.
+MISSING = 'N'
+
+
+class OptimalClusters:
+    """                                 CLASS OptimalClusters
+       __________________________________________________________________________________________
+         The optimal 1-D k-means clusterings of 'values' for every k up to max_k.  Missing (NaN)
+         values are ignored.
+
+         sse                -   sse[k - 1] is the smallest within-cluster sum of squares with
+                                k clusters.  k larger than the number of distinct values gives 0.
+         cutpoints(k)       -   The sorted smallest values of the k optimal clusters.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, values, max_k=10):
+        values = np.asarray(values, dtype=float)
+        self.values, weights = np.unique(values[~np.isnan(values)], return_counts=True)
+        if len(self.values) == 0:
+            raise ValueError('Cannot cluster a column without any value')
+        self.max_k = max_k
+        num_clusters = min(max_k, len(self.values))
+
+        #  Prefix sums of the weights, weighted values and weighted squares give any interval's SSE in O(1).
+        centered = self.values - np.average(self.values, weights=weights)
+        self._weight = np.concatenate([[0.], np.cumsum(weights)])
+        self._sum = np.concatenate([[0.], np.cumsum(weights * centered)])
+        self._square = np.concatenate([[0.], np.cumsum(weights * centered ** 2)])
+
+        n = len(self.values)
+        self._cost = np.empty((num_clusters, n))
+        self._start = np.zeros((num_clusters, n), dtype=np.int64)
+        self._cost[0] = self._interval_sse(np.zeros(n, dtype=np.int64), np.arange(n))
+        for k in range(1, num_clusters):
+            self._cost[k, :k] = np.inf
+            self._fill(k, k, n - 1, k, n - 1)
+
+        self.sse = np.zeros(max_k)
+        self.sse[:num_clusters] = np.maximum(self._cost[:, -1], 0)
+
+    def _interval_sse(self, start, end):
+        #  The SSE of the values with indexes start..end (inclusive), elementwise.
+        weight = self._weight[end + 1] - self._weight[start]
+        total = self._sum[end + 1] - self._sum[start]
+        return self._square[end + 1] - self._square[start] - total ** 2 / weight
+
+    def _fill(self, k, low, high, start_low, start_high):
+        #  Fills _cost[k, low..high], knowing the optimal start of the last cluster lies in start_low..start_high.
+        stack = [(low, high, start_low, start_high)]
+        while stack:
+            low, high, start_low, start_high = stack.pop()
+            if low > high:
+                continue
+            end = (low + high) // 2
+            starts = np.arange(max(k, start_low), min(end, start_high) + 1)
+            costs = self._cost[k - 1, starts - 1] + self._interval_sse(starts, np.full(len(starts), end))
+            best = int(np.argmin(costs))
+            self._cost[k, end] = costs[best]
+            self._start[k, end] = starts[best]
+            stack.append((low, end - 1, start_low, starts[best]))
+            stack.append((end + 1, high, starts[best], start_high))
+
+    def cutpoints(self, k):
+        k = min(k, len(self._cost))
+        bounds = []
+        end = len(self.values) - 1
+        for cluster in range(k - 1, -1, -1):
+            start = self._start[cluster, end] if cluster > 0 else 0
+            bounds.append(float(self.values[start]))
+            end = start - 1
+        return bounds[::-1]
+
+    def elbow(self):
+        """
+        The k whose (k, log SSE) point lies farthest below the line joining k = 1 to k = max_k.  The
+        SSE falls by orders of magnitude until k reaches the number of natural groups, the log scale
+        keeps the first large drop from hiding the others.  If some k leaves no error, the smallest.
+        """
+        ks = np.arange(1, self.max_k + 1)
+        #  Rounding leaves a tiny positive SSE where the clusters hold a single distinct value each.
+        exact = self.sse <= 1e-9 * self.sse[0]
+        if exact[-1]:
+            return int(ks[np.argmax(exact)])
+        if self.max_k < 3:
+            return 1
+        log_sse = np.log(self.sse)
+        line = log_sse[0] + (log_sse[-1] - log_sse[0]) * (ks - 1) / (self.max_k - 1)
+        return int(ks[np.argmax(line - log_sse)])
+
+
+def group_labels(k):
+    #  The states of a column binned into k groups, zero padded so that they sort in the order of the groups.
+    width = len(str(k - 1))
+    return [f'{group:0{width}d}' for group in range(k)]
+
+
+def apply_cutpoints(column: pd.Series, cutpoints):
+    """
+    Returns the group of every value of 'column' as a string Series (see group_labels).  A value
+    belongs to the last group whose cutpoint it reaches, values below the first cutpoint to the
+    first group, and missing values (NaN or 'N') are MISSING.
+    """
+    values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=float)
+    groups = np.clip(np.searchsorted(cutpoints, values, side='right') - 1, 0, None)
+    labels = np.array(group_labels(len(cutpoints)), dtype=object)[groups]
+    labels[np.isnan(values)] = MISSING
+    return pd.Series(labels, index=column.index, name=column.name)
+
+
+def bin_columns(data_frame: pd.DataFrame, columns, max_k=10, k=None, n_jobs=1):
+    """                                 FUNCTION bin_columns
+       __________________________________________________________________________________________
+         Clusters every column of 'columns' and returns a dict mapping each to
+         {'k': ..., 'cutpoints': [...], 'sse': [...]}, the format save_cutpoints writes.
+
+         k                  -   The number of groups: an int for every column, a dict mapping
+                                columns to ints, or None to take the elbow of each column's SSE.
+         n_jobs             -   The number of processes, each clusters whole columns.
+       __________________________________________________________________________________________"""
+    columns = list(columns)
+    ks = [k.get(column) if isinstance(k, dict) else k for column in columns]
+    arguments = [(pd.to_numeric(data_frame[column], errors='coerce').to_numpy(dtype=float), max_k, column_k)
+                 for column, column_k in zip(columns, ks)]
+    if n_jobs <= 1:
+        results = [_bin_column(*argument) for argument in arguments]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(columns))) as executor:
+            results = list(executor.map(_bin_column, *zip(*arguments)))
+    return dict(zip(columns, results))
+
+
+def _bin_column(values, max_k, k):
+    clusters = OptimalClusters(values, max_k)
+    k = clusters.elbow() if k is None else k
+    return {'k': k, 'cutpoints': clusters.cutpoints(k), 'sse': clusters.sse.tolist()}
+
+
+def save_cutpoints(path, binning: dict):
+    with open(path, 'w') as file:
+        json.dump(binning, file, indent=2)
+
+
+def load_cutpoints(path):
+    #  Returns a dict mapping every binned column to its cutpoints, the 'cutpoints' argument of load_compact.
+    with open(path) as file:
+        return {column: entry['cutpoints'] for column, entry in json.load(file).items()}
@@ -0,0 +1,122 @@
+"""
+The command line of the pipeline.
+
+    python cli.py kfold --data ACST_Cust_Data.csv --edges edges.json --k 10 --seed 0 --output Client_Spreadsheets/
+    python cli.py risk --data ACST_Cust_Data.csv --edges edges.json --model risk_model.cmdl
+    python cli.py bin --data ACST_Cust_Sum.csv --columns CongregantUsers --no-plot
+    python cli.py evaluate Client_Spreadsheets/<name>/<name>_predictions.csv --steps 1000
+
+Each subcommand calls one function (general_kfold.kfold_validation, risk_groups.risk_groups and
+Clustering.cluster_columns, evaluation.evaluate), which a scheduler can import and call directly instead.  Only the module
+of the chosen subcommand is imported, and those modules only import pgmpy when they train a network
+and matplotlib when they plot, so a run served from the result cache starts without either.
+'--edges' is a JSON file holding the list of [parent, child] edges, as written by structure_search.py.
+"""
+import argparse
+import json
+import sys
+
+
+def _edges(path):
+    with open(path) as file:
+        return [tuple(edge) for edge in json.load(file)]
+
+
+def _kfold(arguments):
+    from general_kfold import kfold_validation
+    return kfold_validation(data_path=arguments.data, edges=_edges(arguments.edges), target=arguments.target,
+                            k=arguments.k, seed=arguments.seed, drop_cutoff=arguments.drop_cutoff,
+                            stratify=arguments.stratify, n_jobs=arguments.n_jobs,
+                            prediction_cutoff=arguments.prediction_cutoff,
+                            moderate_risk_cutoff=arguments.moderate_risk_cutoff,
+                            output_directory=arguments.output, cache_directory=arguments.cache,
+                            trace_memory=arguments.trace_memory, profile=arguments.profile)
+
+
+def _risk(arguments):
+    from risk_groups import risk_groups
+    return risk_groups(data_path=arguments.data, edges=_edges(arguments.edges), target=arguments.target,
+                       seed=arguments.seed, query_jobs=arguments.query_jobs,
+                       prediction_cutoff=arguments.prediction_cutoff,
+                       moderate_risk_cutoff=arguments.moderate_risk_cutoff,
+                       output_directory=arguments.output, model_path=arguments.model, cache_directory=arguments.cache)
+
+
+def _bin(arguments):
+    from Clustering import cluster_columns
+    return cluster_columns(data_path=arguments.data, columns=arguments.columns, max_k=arguments.max_k,
+                           cutpoints_path=arguments.output, plot=arguments.plot)
+
+
+def _evaluate(arguments):
+    import numpy as np
+    from evaluation import evaluate, load_predictions, report
+    result = evaluate(load_predictions(arguments.predictions), np.linspace(0, 1, arguments.steps + 1), arguments.bins)
+    print(report(result, (arguments.prediction_cutoff, arguments.moderate_risk_cutoff)))
+    print(result['reliability'].to_string(index=False))
+    if arguments.output is not None:
+        result['sweep'].to_csv(arguments.output)
+    return result
+
+
+def build_parser():
+    #  The defaults are the module constants of the scripts, repeated here so that --help imports nothing.
+    parser = argparse.ArgumentParser(description='K-fold validation and risk groups of a Bayesian network.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_common(subparser, output, seed):
+        subparser.add_argument('--data', required=True, help='the .csv or .parquet file')
+        subparser.add_argument('--edges', required=True, help='a JSON file holding the list of [parent, child] edges')
+        subparser.add_argument('--target', default='Satisfied')
+        subparser.add_argument('--seed', type=int, default=seed)
+        subparser.add_argument('--prediction-cutoff', type=float, default=.5,
+                               help='predict the target true above this probability')
+        subparser.add_argument('--moderate-risk-cutoff', type=float, default=.60,
+                               help='the upper end of the moderate risk tier')
+        subparser.add_argument('--output', default=output, help='the directory the spreadsheets are written to')
+        subparser.add_argument('--cache', default='kfold_cache', help='the directory of the result cache')
+
+    kfold = subparsers.add_parser('kfold', help='cross-validate the network and write the client spreadsheets')
+    add_common(kfold, 'Client_Spreadsheets/', 0)
+    kfold.add_argument('--k', type=int, default=10)
+    kfold.add_argument('--drop-cutoff', type=int, default=20,
+                       help='rows with more MissingValues than this are dropped')
+    kfold.add_argument('--stratify', action='store_true')
+    kfold.add_argument('--n-jobs', type=int, default=1, help='the number of processes running the folds')
+    kfold.add_argument('--trace-memory', action='store_true')
+    kfold.add_argument('--profile', action='store_true')
+    kfold.set_defaults(run=_kfold)
+
+    risk = subparsers.add_parser('risk', help='train one network on every row and write the risk spreadsheets')
+    add_common(risk, 'risk_spreadsheets/', 100)
+    risk.add_argument('--query-jobs', type=int, default=1, help='the number of processes answering the queries')
+    risk.add_argument('--model', default='risk_model.cmdl', help='where the trained network is saved')
+    risk.set_defaults(run=_risk)
+
+    binning = subparsers.add_parser('bin', help='bin numeric columns with exact 1-D k-means')
+    binning.add_argument('--data', required=True, help='the .csv file')
+    binning.add_argument('--columns', nargs='+', required=True)
+    binning.add_argument('--max-k', type=int, default=10)
+    binning.add_argument('--output', default='cutpoints.json', help='the JSON file the cutpoints are written to')
+    binning.add_argument('--no-plot', dest='plot', action='store_false', help='do not plot the SSE curves')
+    binning.set_defaults(run=_bin)
+
+    evaluation = subparsers.add_parser('evaluate', help='sweep thresholds over the predictions saved by kfold')
+    evaluation.add_argument('predictions', help='the _predictions.csv file of a kfold run')
+    evaluation.add_argument('--steps', type=int, default=100, help='the thresholds are every 1/steps from 0 to 1')
+    evaluation.add_argument('--bins', type=int, default=10, help='the number of reliability bins')
+    evaluation.add_argument('--prediction-cutoff', type=float, default=.5)
+    evaluation.add_argument('--moderate-risk-cutoff', type=float, default=.60)
+    evaluation.add_argument('--output', help='write the sweep to this .csv file')
+    evaluation.set_defaults(run=_evaluate)
+    return parser
+
+
+def main(argv=None):
+    arguments = build_parser().parse_args(argv)
+    arguments.run(arguments)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+A trained network as a handful of contiguous NumPy arrays, saved to and loaded from a memory-mappable file.
+
+A BayesianNetwork holds a networkx graph and one TabularCPD object per node, so importing pgmpy,
+building the graph and pickling the CPDs dominates the start of a short-lived process, e.g. a
+worker or a scoring service.  CompactModel only keeps the node order, the cardinalities, the
+parents of every node as indexes into the node order (one array plus offsets) and every CPT in a
+single float64 buffer (plus offsets), each CPT laid out as (card_node, card_parent_1, ...) like
+TabularCPD.values.  The states of every node may be kept with it, so that rows can be mapped to
+state indexes without the training data.
+
+The file is an 8 byte magic string, the length of a JSON header, the header (node order, parents,
+cardinalities, offsets, states) and the CPT buffer, aligned so that load() can memory-map it:
+loading costs one small read whatever the size of the CPTs, and processes loading the same file
+share its pages.  The compiled engines (see compiled_inference.py) work from the arrays directly;
+pgmpy is only imported by to_network().
+"""
+import json
+
+import numpy as np
+
+from compiled_inference import MarkovBlanketPosterior, MissingMaskPlanner, MAX_CELLS
+
+MAGIC = b'KFCMDL01'
+#  The offset of the CPT buffer in the file is a multiple of this.
+ALIGNMENT = 64
+
+
+class CompactModel:
+    """                                 CLASS CompactModel
+       __________________________________________________________________________________________
+         nodes              -   The node names, in the order every array follows.
+         cardinalities      -   cardinalities[i] is the number of states of nodes[i].
+         parent_offsets     -   The parents of nodes[i] are the nodes whose indexes are
+         parent_indexes         parent_indexes[parent_offsets[i]:parent_offsets[i + 1]].
+         cpt_offsets        -   The CPT of nodes[i] is cpt_buffer[cpt_offsets[i]:cpt_offsets[i + 1]],
+         cpt_buffer             of shape (card_node, card_parent_1, ...) once reshaped.
+         states             -   Maps every node to the sorted list of its states, or None.
+
+         Use from_network or from_cpds to build one and load to read a saved one.
+       __________________________________________________________________________________________"""
+
+    __slots__ = ('nodes', 'cardinalities', 'parent_offsets', 'parent_indexes', 'cpt_offsets', 'cpt_buffer',
+                 'states', '_index')
+
+    def __init__(self, nodes, cardinalities, parent_offsets, parent_indexes, cpt_offsets, cpt_buffer, states=None):
+        self.nodes = tuple(nodes)
+        self.cardinalities = np.asarray(cardinalities, dtype=np.int64)
+        self.parent_offsets = np.asarray(parent_offsets, dtype=np.int64)
+        self.parent_indexes = np.asarray(parent_indexes, dtype=np.int64)
+        self.cpt_offsets = np.asarray(cpt_offsets, dtype=np.int64)
+        self.cpt_buffer = cpt_buffer
+        self.states = states
+        self._index = {node: i for i, node in enumerate(self.nodes)}
+
+    @classmethod
+    def from_cpds(cls, nodes: list, parents_of_node: list, cardinalities: dict, cpds: list, states=None):
+        #  The arguments of bayes_net_model.bn_from_cpds (without the edges), cpds[i] being the table of nodes[i].
+        index = {node: i for i, node in enumerate(nodes)}
+        parent_offsets = np.cumsum([0] + [len(parents) for parents in parents_of_node])
+        parent_indexes = [index[parent] for parents in parents_of_node for parent in parents]
+        cpt_buffer = np.concatenate([np.asarray(cpd, dtype=np.float64).reshape(-1) for cpd in cpds])
+        cpt_offsets = np.cumsum([0] + [np.size(cpd) for cpd in cpds])
+        if states is not None:
+            states = {node: [json_value(state) for state in states[node]] for node in nodes if node in states}
+        return cls(nodes, [cardinalities[node] for node in nodes], parent_offsets, parent_indexes, cpt_offsets,
+                   cpt_buffer, states)
+
+    @classmethod
+    def from_network(cls, bn, states=None):
+        #  'states' (e.g. from load_compact) is kept with the model, see the class docstring.
+        nodes = list(bn.nodes)
+        cpds = [bn.get_cpds(node) for node in nodes]
+        return cls.from_cpds(nodes, [cpd.variables[1:] for cpd in cpds],
+                             {cpd.variable: int(cpd.variable_card) for cpd in cpds},
+                             [cpd.values for cpd in cpds], states)
+
+    def with_states(self, states):
+        #  The same model, sharing its arrays, keeping 'states', e.g. for a model loaded from the result cache.
+        states = {node: [json_value(state) for state in states[node]] for node in self.nodes if node in states}
+        return CompactModel(self.nodes, self.cardinalities, self.parent_offsets, self.parent_indexes, self.cpt_offsets,
+                            self.cpt_buffer, states)
+
+    def parents(self, node):
+        i = self._index[node]
+        return [self.nodes[j] for j in self.parent_indexes[self.parent_offsets[i]:self.parent_offsets[i + 1]]]
+
+    def cpt(self, node):
+        #  A view of the CPT of 'node' of shape (card_node, card_parent_1, ...), read only when memory-mapped.
+        i = self._index[node]
+        shape = [self.cardinalities[i]] + [self.cardinalities[j] for j in
+                                           self.parent_indexes[self.parent_offsets[i]:self.parent_offsets[i + 1]]]
+        return self.cpt_buffer[self.cpt_offsets[i]:self.cpt_offsets[i + 1]].reshape(shape)
+
+    def cardinality(self):
+        #  Maps every node to its number of states, as BayesianNetwork.get_cardinality does.
+        return {node: int(card) for node, card in zip(self.nodes, self.cardinalities)}
+
+    def edges(self):
+        return [(parent, node) for node in self.nodes for parent in self.parents(node)]
+
+    def leaves(self):
+        has_children = set(self.parent_indexes.tolist())
+        return [node for i, node in enumerate(self.nodes) if i not in has_children]
+
+    def factors(self):
+        #  A (variables, values) pair per CPT, the 'factors' of MarkovBlanketPosterior and MissingMaskPlanner.
+        return [([node] + self.parents(node), self.cpt(node)) for node in self.nodes]
+
+    def markov_blanket_posterior(self, target: str):
+        factors = [factor for factor in self.factors() if target in factor[0]]
+        return MarkovBlanketPosterior(target, factors, self.cardinality(), self.leaves())
+
+    def planner(self, target: str, max_cells=MAX_CELLS):
+        return MissingMaskPlanner(target, self.factors(), self.cardinality(), max_cells)
+
+    def to_network(self):
+        #  The equivalent BayesianNetwork.  This is the only method that imports pgmpy.
+        from bayes_net_model import bn_from_cpds
+        nodes = list(self.nodes)
+        return bn_from_cpds(self.edges(), nodes, [self.parents(node) for node in nodes], self.cardinality(),
+                            [np.array(self.cpt(node)).reshape(self.cardinality()[node], -1) for node in nodes])
+
+    def save(self, path):
+        header = json.dumps({'nodes': list(self.nodes),
+                             'cardinalities': self.cardinalities.tolist(),
+                             'parent_offsets': self.parent_offsets.tolist(),
+                             'parent_indexes': self.parent_indexes.tolist(),
+                             'cpt_offsets': self.cpt_offsets.tolist(),
+                             'states': self.states}).encode()
+        start = len(MAGIC) + 8 + len(header)
+        padding = -start % ALIGNMENT
+        with open(path, 'wb') as file:
+            file.write(MAGIC)
+            file.write(np.uint64(len(header) + padding).tobytes())
+            file.write(header + b' ' * padding)
+            file.write(np.ascontiguousarray(self.cpt_buffer, dtype='<f8').tobytes())
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        #  With mmap the CPT buffer is a read-only np.memmap of the file, otherwise it is read into memory.
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a saved CompactModel')
+            header_length = int(np.frombuffer(file.read(8), dtype=np.uint64)[0])
+            header = json.loads(file.read(header_length))
+        offset = len(MAGIC) + 8 + header_length
+        size = header['cpt_offsets'][-1]
+        if mmap:
+            cpt_buffer = np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(size,))
+        else:
+            cpt_buffer = np.fromfile(path, dtype='<f8', count=size, offset=offset)
+        return cls(header['nodes'], header['cardinalities'], header['parent_offsets'], header['parent_indexes'],
+                   header['cpt_offsets'], cpt_buffer, header['states'])
+
+    def __getstate__(self):
+        #  Pickles as plain arrays, a memory-mapped buffer is copied.
+        return {name: getattr(self, name) for name in self.__slots__ if name != '_index'} | \
+            {'cpt_buffer': np.asarray(self.cpt_buffer)}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def json_value(value):
+    #  Converts numpy scalars (e.g. np.int64, np.bool_) to the Python values json can write, also used by result_cache.
+    return value.item() if hasattr(value, 'item') else value
@@ -0,0 +1,241 @@
+"""
+Compiled inference for fully observed evidence.
+
+When every variable in the Markov blanket of the target is observed, the posterior of the
+target only depends on the CPTs that mention the target (its own CPT and the CPTs of its
+children), so P(target | evidence) can be tabulated once for the whole evidence space.
+
+When that table would be too large, MarkovBlanketPosterior computes the same product of factors
+row by row instead, in log space, for any number of rows at once.
+
+MissingMaskPlanner handles missing values ('N') too.  Rows are grouped by which variables are
+missing, the missing variables are summed out of the network's factors once per group, and every
+row of the group is answered by a gather from the remaining factors.
+
+Every class answers with answer(codes, observed), which only answers the rows it can answer
+exactly and leaves the rest to a general engine.
+"""
+import math
+import string
+
+import numpy as np
+
+#  Default limit on the number of cells of a compiled table (80 MB of float64).
+MAX_CELLS = 10 ** 7
+
+
+class CompiledPosterior:
+    """                                 CLASS CompiledPosterior
+       __________________________________________________________________________________________
+         'table' is a dense array of shape (card_blanket_1, ..., card_blanket_n, card_target)
+         whose entry at (s_1, ..., s_n) is P(target | blanket = (s_1, ..., s_n)), where the
+         blanket variables are listed in 'variables'.  States are indexed exactly as in the
+         CPTs, i.e. by 'state_mapping'.
+
+         bn                 -   A BayesianNetwork whose CPDs have been added.
+         target             -   The name of the target variable.
+         max_cells          -   A ValueError is raised if the table would be larger than this.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, bn, target: str, max_cells=MAX_CELLS):
+        self.target = target
+        cpds = [cpd for cpd in bn.get_cpds() if target in cpd.variables]
+        in_blanket = {variable for cpd in cpds for variable in cpd.variables} - {target}
+        self.variables = [node for node in bn.nodes if node in in_blanket]
+        self.cardinality = bn.get_cardinality()
+
+        axes = self.variables + [target]
+        shape = [self.cardinality[variable] for variable in axes]
+        if math.prod(shape) > max_cells:
+            raise ValueError(f'The compiled table for {target} would have {math.prod(shape)} cells '
+                             f'(limit {max_cells})')
+
+        #  The unnormalized posterior is the product of the factors that mention the target.
+        letters = dict(zip(axes, string.ascii_letters))
+        subscripts = ','.join(''.join(letters[v] for v in cpd.variables) for cpd in cpds)
+        subscripts += '->' + ''.join(letters[v] for v in axes)
+        table = np.einsum(subscripts, *[cpd.values for cpd in cpds])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.table = table / table.sum(axis=-1, keepdims=True)
+
+    def lookup(self, codes: dict):
+        """
+        'codes' maps every blanket variable to an integer array of state indexes.  Returns
+        an array of shape (number of rows, card_target) holding the posterior of each row.
+        """
+        return self.table[tuple(np.asarray(codes[variable]) for variable in self.variables)]
+
+    def answer(self, codes: dict, observed: dict):
+        """
+        'codes' maps variables to integer arrays of state indexes and 'observed' maps them to
+        boolean arrays, False where the value is missing.  Returns (answered, posteriors): the
+        mask of the rows whose blanket is observed and in range, and their posteriors.
+        """
+        answered = _in_range(codes, observed, self.cardinality)
+        for variable in self.variables:
+            answered &= observed[variable]
+        return answered, self.lookup({variable: codes[variable][answered] for variable in self.variables})
+
+
+class MarkovBlanketPosterior:
+    """                                 CLASS MarkovBlanketPosterior
+       __________________________________________________________________________________________
+         Computes P(target | evidence) as the normalized product of the factors that mention
+         the target, gathered for every row and summed in log space, without a table over the
+         whole blanket.  This is exact when the target's parents and the other parents of its
+         observed children are observed.  A missing child without children of its own sums out
+         of the product (its CPT sums to one over its states) and is simply skipped.  A row
+         that needs anything else is not answered.
+
+         target             -   The name of the target variable.
+         factors            -   (variables, values) pairs: the CPDs containing the target, their
+                                variables listed as in TabularCPD.variables and their values of
+                                shape (card_variable_1, ..., card_variable_n).
+         cardinality        -   Maps every variable to its number of states.
+         leaves             -   The variables without children.
+
+         Use from_network to build one from a BayesianNetwork.  Only arrays are kept, so a
+         model that is not a pgmpy network can pass its CPTs directly.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, target: str, factors: list, cardinality: dict, leaves):
+        self.target = target
+        self.cardinality = cardinality
+        #  The parents of the target, and the other parents of each of its children.
+        self.parents = [variable for variables, _ in factors if variables[0] == target for variable in variables[1:]]
+        self.co_parents = {variables[0]: [variable for variable in variables[1:] if variable != target]
+                           for variables, _ in factors if variables[0] != target}
+        self.skippable = {child for child in self.co_parents if child in set(leaves)}
+        with np.errstate(divide='ignore'):
+            self.factors = [(list(variables), np.log(values)) for variables, values in factors]
+
+    @classmethod
+    def from_network(cls, bn, target: str):
+        factors = [(cpd.variables, cpd.values) for cpd in bn.get_cpds() if target in cpd.variables]
+        leaves = [node for node in bn.nodes if bn.out_degree(node) == 0]
+        return cls(target, factors, bn.get_cardinality(), leaves)
+
+    def answer(self, codes: dict, observed: dict):
+        #  As CompiledPosterior.answer.
+        answered = _in_range(codes, observed, self.cardinality)
+        for parent in self.parents:
+            answered &= observed[parent]
+        #  The other parents of a child only matter where the child is observed.
+        for child, co_parents in self.co_parents.items():
+            if child not in self.skippable:
+                answered &= observed[child]
+            for co_parent in co_parents:
+                answered &= ~observed[child] | observed[co_parent]
+
+        rows = np.flatnonzero(answered)
+        log_posterior = np.zeros((len(rows), self.cardinality[self.target]))
+        for variables, log_values in self.factors:
+            gathered = _gather(variables, log_values, self.target, codes, rows)
+            if variables[0] != self.target:
+                gathered = np.where(observed[variables[0]][rows][:, None], gathered, 0.)
+            log_posterior += gathered
+        return answered, _normalize(log_posterior)
+
+
+class MissingMaskPlanner:
+    """                                 CLASS MissingMaskPlanner
+       __________________________________________________________________________________________
+         Answers P(target | evidence) for rows with any pattern of missing values.  The rows
+         are grouped by the set of observed variables (their mask); for each mask the variables
+         that are not observed are summed out of the product of the network's factors, in a
+         greedy order, and the factors left that mention the target are kept.  The posterior of
+         a row is then their normalized product gathered at the row's states, in log space.  The
+         reduced factors of every mask are cached, so the cost grows with the number of masks
+         rather than the number of distinct rows.
+
+         factors            -   (variables, values) pairs for every CPD of the network, as for
+                                MarkovBlanketPosterior.
+         max_cells          -   Rows of a mask whose elimination would create a factor larger
+                                than this are not answered.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, target: str, factors: list, cardinality: dict, max_cells=MAX_CELLS):
+        self.target = target
+        self.factors = [(list(variables), np.asarray(values)) for variables, values in factors]
+        self.cardinality = cardinality
+        self.max_cells = max_cells
+        self.plans = {}
+
+    @classmethod
+    def from_network(cls, bn, target: str, max_cells=MAX_CELLS):
+        return cls(target, [(cpd.variables, cpd.values) for cpd in bn.get_cpds()], bn.get_cardinality(), max_cells)
+
+    def plan(self, observed_variables: frozenset):
+        """
+        The log factors mentioning the target once every variable but the target and the
+        'observed_variables' has been summed out, or None if that needs a factor too large.
+        """
+        if observed_variables not in self.plans:
+            self.plans[observed_variables] = self._eliminate(observed_variables)
+        return self.plans[observed_variables]
+
+    def _eliminate(self, observed_variables):
+        factors = list(self.factors)
+        hidden = {variable for variables, _ in factors for variable in variables} - observed_variables - {self.target}
+        while hidden:
+            #  Greedily sum out the variable whose elimination creates the smallest factor.
+            scopes = {variable: set().union(*(variables for variables, _ in factors if variable in variables))
+                      for variable in hidden}
+            variable = min(hidden, key=lambda v: math.prod(self.cardinality[u] for u in scopes[v]))
+            scope = [u for u in scopes[variable] if u != variable]
+            if math.prod(self.cardinality[u] for u in scope) > self.max_cells:
+                return None
+            involved = [factor for factor in factors if variable in factor[0]]
+            factors = [factor for factor in factors if variable not in factor[0]]
+            letters = dict(zip(scopes[variable], string.ascii_letters))
+            subscripts = ','.join(''.join(letters[u] for u in variables) for variables, _ in involved)
+            subscripts += '->' + ''.join(letters[u] for u in scope)
+            factors.append((scope, np.einsum(subscripts, *[values for _, values in involved])))
+            hidden.remove(variable)
+        with np.errstate(divide='ignore'):
+            return [(variables, np.log(values)) for variables, values in factors if self.target in variables]
+
+    def answer(self, codes: dict, observed: dict):
+        #  As CompiledPosterior.answer.  'codes' should hold every environment variable, those it lacks count as missing.
+        variables = [variable for variable in codes if variable != self.target and variable in self.cardinality]
+        answered = _in_range(codes, observed, self.cardinality)
+        posterior = np.full((len(answered), self.cardinality[self.target]), np.nan)
+        masks, mask_of_row = np.unique(np.column_stack([observed[variable] for variable in variables]),
+                                       axis=0, return_inverse=True)
+        mask_of_row = mask_of_row.reshape(-1)
+        for m, mask in enumerate(masks):
+            rows = np.flatnonzero((mask_of_row == m) & answered)
+            factors = self.plan(frozenset(variable for variable, seen in zip(variables, mask) if seen))
+            if factors is None:
+                answered[mask_of_row == m] = False
+                continue
+            log_posterior = np.zeros((len(rows), self.cardinality[self.target]))
+            for factor_variables, log_values in factors:
+                log_posterior += _gather(factor_variables, log_values, self.target, codes, rows)
+            posterior[rows] = _normalize(log_posterior)
+        return answered, posterior[answered]
+
+
+def _gather(variables, values, target, codes: dict, rows):
+    #  values[state of each row, every target state] for the factor over 'variables', of shape (len(rows), card_target).
+    target_states = np.arange(values.shape[variables.index(target)])[None, :]
+    index = tuple(target_states if variable == target else np.maximum(codes[variable][rows], 0)[:, None]
+                  for variable in variables)
+    return values[index]
+
+
+def _normalize(log_posterior):
+    #  Exponentiates and normalizes each row of an unnormalized log posterior.
+    with np.errstate(invalid='ignore'):
+        log_posterior = log_posterior - log_posterior.max(axis=1, keepdims=True)
+        posterior = np.exp(log_posterior)
+        return posterior / posterior.sum(axis=1, keepdims=True)
+
+
+def _in_range(codes: dict, observed: dict, cardinality: dict):
+    #  False for the rows holding an observed state the network has not seen.
+    in_range = np.ones(len(next(iter(codes.values()))), dtype=bool)
+    for variable, variable_codes in codes.items():
+        if variable in cardinality:
+            in_range &= ~observed[variable] | ((variable_codes >= 0) & (variable_codes < cardinality[variable]))
+    return in_range
@@ -0,0 +1,162 @@
+"""
+Streaming, memory compact loading of the customer data.
+
+Only the columns the network needs are read, in chunks.  Every network variable is stored as a
+pandas Categorical whose categories are its states in sorted order, so the integer codes (int8 or
+int16 for our variables) are exactly the indexes 'state_mapping' assigns and the sorted state
+lists are computed once instead of by every module that calls .unique().
+
+Both .csv and .parquet files can be read; Parquet requires pyarrow.
+
+Given the cutpoints of a binning (see binning.py), the <column>_grouped variables are computed from
+their numeric source columns as the chunks are read, so they need not be stored in the file.
+"""
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from binning import apply_cutpoints
+
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def read_chunks(path, columns, chunksize=DEFAULT_CHUNKSIZE, cutpoints=None):
+    """
+    Yields DataFrames of at most 'chunksize' rows holding 'columns' (None for every column) of the .csv or
+    .parquet file at 'path'.  'cutpoints' optionally maps numeric columns to the cutpoints of their binning
+    (binning.load_cutpoints).  Every requested <column>_grouped is then computed from <column> instead of being read.
+    """
+    columns = list(columns) if columns is not None else []
+    derived = {f'{column}_grouped': column for column in (cutpoints or {}) if f'{column}_grouped' in columns}
+    read = list(dict.fromkeys([column for column in columns if column not in derived] + list(derived.values()))) \
+        if columns else None
+    if str(path).endswith('.parquet'):
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=read))
+    else:
+        chunks = pd.read_csv(path, usecols=read, chunksize=chunksize)
+    for chunk in chunks:
+        for grouped, column in derived.items():
+            chunk[grouped] = apply_cutpoints(chunk[column], cutpoints[column])
+        yield chunk[columns] if derived else chunk
+
+
+def scan_states(path, variables, row_filter=None, chunksize=DEFAULT_CHUNKSIZE, cutpoints=None):
+    """
+    Reads the file once, keeping only the distinct values of each of 'variables', and returns a dict
+    mapping every variable to the sorted list of its states.  Memory is bounded by the number of states.
+    """
+    variables = list(variables)
+    seen = {variable: [] for variable in variables}
+    for chunk in read_chunks(path, variables, chunksize, cutpoints):
+        if row_filter is not None:
+            chunk = chunk.loc[row_filter(chunk)]
+        if chunk.empty:
+            continue
+        for variable in variables:
+            seen[variable].append(pd.Index(chunk[variable].unique()))
+    states = {}
+    for variable in variables:
+        indexes = _common_dtype(seen[variable])
+        states[variable] = sorted(indexes[0].append(indexes[1:]).unique()) if indexes else []
+    return states
+
+
+def category_codes(column: pd.Series, states):
+    #  The index of every value of 'column' in the sorted list 'states' returned by scan_states (-1 if absent).
+    states = pd.Index(states)
+    if states.dtype == object and column.dtype != object:
+        column = column.astype(str)
+    return pd.Categorical(column, categories=states).codes
+
+
+def load_compact(path, variables, passthrough=('ID',), row_filter=None, chunksize=DEFAULT_CHUNKSIZE,
+                 cutpoints=None):
+    """                                 FUNCTION load_compact
+       __________________________________________________________________________________________
+         Returns a pair (data_frame, states).  'data_frame' holds the 'variables' as sorted
+         Categorical columns and the 'passthrough' columns (downcast if numeric) with a fresh
+         RangeIndex.  'states' maps every variable to the sorted list of its states, the same
+         list 'state_mapping' and 'make_cpd' would compute.
+
+         path               -   The path of the .csv or .parquet file.
+         variables          -   The network variables to read and encode.
+         passthrough        -   Other columns to read as they are (e.g. the client ID).
+         row_filter         -   An optional function taking a chunk and returning a boolean mask
+                                of the rows to keep, e.g. lambda c: c['MissingValues'] <= 20.
+                                It sees the chunk before encoding.  A ValueError is raised if
+                                no row is left.
+         chunksize          -   The number of rows read at a time.
+         cutpoints          -   Optional cutpoints of binned columns, see read_chunks.
+       __________________________________________________________________________________________"""
+    variables = list(variables)
+    passthrough = [column for column in passthrough if column not in variables]
+    encoded = {variable: [] for variable in variables}
+    kept = {column: [] for column in passthrough}
+    num_rows = 0
+    for chunk in read_chunks(path, variables + passthrough, chunksize, cutpoints):
+        if row_filter is not None:
+            chunk = chunk.loc[row_filter(chunk)]
+        if chunk.empty:
+            continue
+        num_rows += len(chunk)
+        for variable in variables:
+            encoded[variable].append(chunk[variable].astype('category').array)
+        for column in passthrough:
+            kept[column].append(chunk[column])
+    if num_rows == 0:
+        raise ValueError(f'No row of {path} is left' + (f' by the row_filter {row_filter!r}' if row_filter else ''))
+
+    columns = {}
+    for column in passthrough:
+        values = pd.concat(kept[column], ignore_index=True)
+        if pd.api.types.is_integer_dtype(values):
+            values = pd.to_numeric(values, downcast='integer')
+        columns[column] = values
+    for variable in variables:
+        columns[variable] = pd.Series(_union_sorted(encoded[variable]))
+    data_frame = pd.DataFrame(columns)[[column for column in passthrough] + variables]
+    states = {variable: list(data_frame[variable].cat.categories) for variable in variables}
+    return data_frame, states
+
+
+def load_rows(path, ids, row_filter=None, id_column='ID', chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Returns every column of the rows of the file at 'path' whose 'id_column' is in 'ids' and which pass
+    'row_filter' (see load_compact), in file order.  The file is read in chunks and only those rows are
+    kept, e.g. to write the full rows of the clients in the risk groups.
+    """
+    ids = pd.unique(pd.Series(list(ids)))
+    kept = []
+    columns = None
+    for chunk in read_chunks(path, None, chunksize):
+        columns = chunk.columns
+        if row_filter is not None:
+            chunk = chunk.loc[row_filter(chunk)]
+        chunk = chunk.loc[chunk[id_column].isin(ids)]
+        if not chunk.empty:
+            kept.append(chunk)
+    if not kept:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(kept, ignore_index=True)
+
+
+def _common_dtype(indexes):
+    """
+    A column read chunk by chunk may infer a different dtype in some chunks than in others (e.g. a
+    chunk without any 'N' reads as integers), so the values are brought to the dtype read_csv gives
+    the whole column: strings if any chunk read strings, otherwise a common numeric type.
+    """
+    dtypes = {index.dtype for index in indexes}
+    if len(dtypes) > 1:
+        if any(dtype == object for dtype in dtypes):
+            return [index.astype(str) for index in indexes]
+        return [index.astype(float) for index in indexes]
+    return indexes
+
+
+def _union_sorted(categoricals):
+    #  Concatenates the Categoricals of one column read chunk by chunk, with sorted categories.
+    categories = _common_dtype([categorical.categories for categorical in categoricals])
+    categoricals = [categorical.rename_categories(new_categories)
+                    for categorical, new_categories in zip(categoricals, categories)]
+    return union_categoricals(categoricals, sort_categories=True)
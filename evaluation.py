@@ -0,0 +1,232 @@
+"""
+Threshold sweeps and calibration metrics from the out-of-fold probabilities of a validation run.
+
+Every row of a K-fold run is predicted once, by the network of the fold it was held out from, so the
+'scores' frame of score_test_groups (fold, ID, prediction, actual) already holds everything needed to
+evaluate any cutoff.  save_predictions keeps those columns next to the report, and the functions below
+recompute from them, without training or querying anything again:
+
+    threshold_sweep      -   accuracy, precision, recall and F1 at every threshold of a grid, pooled
+                             over every row and as the mean and std over the folds, like the report.
+    roc_curve            -   the ROC and precision-recall curves at every distinct probability,
+    pr_curve                 with the area under the ROC curve and the average precision.
+    brier_score          -   the mean squared error of the probabilities.
+    reliability_bins     -   the mean probability and the observed rate of the target per bin.
+
+Counts at every threshold come from one sort and a searchsorted, so a grid of thousands of thresholds
+costs about as much as one.  Rows whose query failed (a NaN prediction) are left out, as they are
+from the report's accuracy.  scoring.rescore then applies the chosen cutoffs to the risk tiers.
+
+    python cli.py evaluate Client_Spreadsheets/<name>/<name>_predictions.csv
+"""
+import numpy as np
+import pandas as pd
+
+#  The default threshold grid, every hundredth of a probability.
+DEFAULT_THRESHOLDS = np.linspace(0, 1, 101)
+NUM_BINS = 10
+#  The columns of 'scores' that save_predictions keeps.
+PREDICTION_COLUMNS = ['fold', 'ID', 'prediction', 'actual']
+METRICS = ['accuracy', 'precision', 'recall', 'f1']
+
+
+def save_predictions(path, scores: pd.DataFrame):
+    #  Writes the out-of-fold probabilities of 'scores' to the .csv file at 'path', see load_predictions.
+    scores.assign(fold=_folds(scores))[PREDICTION_COLUMNS].to_csv(path, index=False)
+
+
+def load_predictions(path):
+    return pd.read_csv(path, dtype={'actual': bool})
+
+
+def confusion_counts(prediction, actual, thresholds=DEFAULT_THRESHOLDS):
+    """                                 FUNCTION confusion_counts
+       __________________________________________________________________________________________
+         Returns (tp, fp, tn, fn), each an array holding the count at every threshold, where a
+         row is predicted true when its prediction is above the threshold (as in scoring.py).
+
+         prediction         -   The probabilities that the target is true, NaN rows are ignored.
+         actual             -   The true values of the target.
+       __________________________________________________________________________________________"""
+    prediction = np.asarray(prediction, dtype=float)
+    actual = np.asarray(actual, dtype=bool)
+    known = ~np.isnan(prediction)
+    positives = np.sort(prediction[known & actual])
+    negatives = np.sort(prediction[known & ~actual])
+    thresholds = np.asarray(thresholds, dtype=float)
+    tp = len(positives) - np.searchsorted(positives, thresholds, side='right')
+    fp = len(negatives) - np.searchsorted(negatives, thresholds, side='right')
+    return tp, fp, len(negatives) - fp, len(positives) - tp
+
+
+def _metrics(tp, fp, tn, fn):
+    #  Accuracy, precision, recall and F1 from confusion counts, NaN where a ratio has no denominator.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = tp / (tp + fp)
+        recall = tp / (tp + fn)
+        return {'accuracy': (tp + tn) / (tp + fp + tn + fn),
+                'precision': precision,
+                'recall': recall,
+                'f1': 2 * tp / (2 * tp + fp + fn)}
+
+
+def threshold_sweep(scores: pd.DataFrame, thresholds=DEFAULT_THRESHOLDS):
+    """                                 FUNCTION threshold_sweep
+       __________________________________________________________________________________________
+         Returns a DataFrame indexed by threshold with, for every metric of METRICS, the column
+         <metric> computed over every row and the columns <metric>_mean and <metric>_std, its
+         mean and standard deviation over the folds of 'scores' (a frame without a 'fold'
+         column is a single fold), after the columns tp, fp, tn and fn counted over every row.
+       __________________________________________________________________________________________"""
+    thresholds = np.asarray(thresholds, dtype=float)
+    prediction = scores['prediction'].to_numpy(dtype=float)
+    actual = scores['actual'].to_numpy(dtype=bool)
+    folds = _folds(scores)
+    tp, fp, tn, fn = confusion_counts(prediction, actual, thresholds)
+    sweep = pd.DataFrame({'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn, **_metrics(tp, fp, tn, fn)},
+                         index=pd.Index(thresholds, name='threshold'))
+
+    per_fold = [_metrics(*confusion_counts(prediction[folds == fold], actual[folds == fold], thresholds))
+                for fold in np.unique(folds)]
+    for metric in METRICS:
+        #  A fold where the metric is undefined (e.g. no row predicted true) is left out of its mean and std.
+        values = np.stack([fold_metrics[metric] for fold_metrics in per_fold])
+        defined = ~np.isnan(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(defined, values, 0).sum(axis=0) / defined.sum(axis=0)
+            sweep[f'{metric}_mean'] = mean
+            variance = np.where(defined, (values - mean) ** 2, 0).sum(axis=0) / defined.sum(axis=0)
+            sweep[f'{metric}_std'] = np.sqrt(variance)
+    return sweep
+
+
+def roc_curve(prediction, actual):
+    """
+    Returns (false_positive_rate, true_positive_rate, thresholds, auc).  The ith point is the rates
+    of predicting true at or above thresholds[i], every distinct probability from the highest down,
+    preceded by (0, 0) at threshold inf.  auc is the area under the curve by the trapezoid rule.
+    """
+    tp, fp, thresholds = _cumulative_counts(prediction, actual)
+    true_positive_rate = tp / tp[-1] if tp[-1] else np.full(len(tp), np.nan)
+    false_positive_rate = fp / fp[-1] if fp[-1] else np.full(len(fp), np.nan)
+    auc = float(np.sum(np.diff(false_positive_rate) * (true_positive_rate[1:] + true_positive_rate[:-1]) / 2))
+    return false_positive_rate, true_positive_rate, thresholds, auc
+
+
+def pr_curve(prediction, actual):
+    """
+    Returns (precision, recall, thresholds, average_precision) at the same points as roc_curve,
+    without the starting point.  average_precision is the sum over the points of the precision
+    times the increase in recall.
+    """
+    tp, fp, thresholds = _cumulative_counts(prediction, actual)
+    tp, fp, thresholds = tp[1:], fp[1:], thresholds[1:]
+    precision = tp / (tp + fp)
+    recall = tp / tp[-1] if len(tp) and tp[-1] else np.full(len(tp), np.nan)
+    average_precision = float(np.sum(np.diff(np.concatenate([[0.], recall])) * precision))
+    return precision, recall, thresholds, average_precision
+
+
+def _cumulative_counts(prediction, actual):
+    #  The true and false positives when predicting true at or above each distinct probability, highest first.
+    prediction = np.asarray(prediction, dtype=float)
+    actual = np.asarray(actual, dtype=bool)
+    known = ~np.isnan(prediction)
+    prediction, actual = prediction[known], actual[known]
+    order = np.argsort(-prediction, kind='stable')
+    prediction, actual = prediction[order], actual[order]
+    #  The last row of every run of equal probabilities.
+    ends = np.flatnonzero(np.diff(prediction, append=-np.inf))
+    tp = np.cumsum(actual)[ends]
+    fp = (ends + 1) - tp
+    return np.concatenate([[0], tp]), np.concatenate([[0], fp]), np.concatenate([[np.inf], prediction[ends]])
+
+
+def brier_score(prediction, actual):
+    prediction = np.asarray(prediction, dtype=float)
+    known = ~np.isnan(prediction)
+    return float(np.mean((prediction[known] - np.asarray(actual, dtype=float)[known]) ** 2))
+
+
+def reliability_bins(prediction, actual, num_bins=NUM_BINS):
+    """
+    Returns a DataFrame with one row per bin of equal width on [0, 1]: its bounds, the number of
+    rows, their mean probability and the proportion whose target is true.  The expected
+    calibration error is the mean of |mean_prediction - observed_rate| weighted by count.
+    """
+    prediction = np.asarray(prediction, dtype=float)
+    actual = np.asarray(actual, dtype=float)
+    known = ~np.isnan(prediction)
+    prediction, actual = prediction[known], actual[known]
+    edges = np.linspace(0, 1, num_bins + 1)
+    bins = np.clip(np.searchsorted(edges, prediction, side='right') - 1, 0, num_bins - 1)
+    count = np.bincount(bins, minlength=num_bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({'lower': edges[:-1],
+                             'upper': edges[1:],
+                             'count': count,
+                             'mean_prediction': np.bincount(bins, prediction, num_bins) / count,
+                             'observed_rate': np.bincount(bins, actual, num_bins) / count})
+
+
+def expected_calibration_error(bins: pd.DataFrame):
+    filled = bins['count'] > 0
+    gaps = (bins['mean_prediction'] - bins['observed_rate']).abs()[filled]
+    return float(np.average(gaps, weights=bins['count'][filled])) if filled.any() else float('nan')
+
+
+def evaluate(scores: pd.DataFrame, thresholds=DEFAULT_THRESHOLDS, num_bins=NUM_BINS):
+    """                                 FUNCTION evaluate
+       __________________________________________________________________________________________
+         Every metric of this module for 'scores' (see score_test_groups), as a dict with the
+         keys 'sweep' (threshold_sweep), 'roc' and 'pr' (the arrays of roc_curve and pr_curve),
+         'reliability' (reliability_bins) and 'summary', a dict of plain numbers: the AUC,
+         average precision, Brier score and expected calibration error over every row, the mean
+         and std over the folds of the AUC and Brier score, and the threshold of the best F1.
+       __________________________________________________________________________________________"""
+    prediction = scores['prediction'].to_numpy(dtype=float)
+    actual = scores['actual'].to_numpy(dtype=bool)
+    folds = _folds(scores)
+    sweep = threshold_sweep(scores, thresholds)
+    *roc, auc = roc_curve(prediction, actual)
+    *pr, average_precision = pr_curve(prediction, actual)
+    bins = reliability_bins(prediction, actual, num_bins)
+
+    fold_auc = np.array([roc_curve(prediction[folds == fold], actual[folds == fold])[3] for fold in np.unique(folds)])
+    fold_brier = np.array([brier_score(prediction[folds == fold], actual[folds == fold]) for fold in np.unique(folds)])
+    best = sweep['f1'].idxmax() if sweep['f1'].notna().any() else float('nan')
+    summary = {'rows': int((~np.isnan(prediction)).sum()),
+               'auc': auc,
+               'auc_mean': float(np.nanmean(fold_auc)),
+               'auc_std': float(np.nanstd(fold_auc)),
+               'average_precision': average_precision,
+               'brier_score': brier_score(prediction, actual),
+               'brier_score_mean': float(np.mean(fold_brier)),
+               'brier_score_std': float(np.std(fold_brier)),
+               'expected_calibration_error': expected_calibration_error(bins),
+               'best_f1_threshold': float(best),
+               'best_f1': float(sweep['f1'].max())}
+    return {'sweep': sweep, 'roc': roc, 'pr': pr, 'reliability': bins, 'summary': summary}
+
+
+def report(evaluation: dict, thresholds=(.5, .6)):
+    #  The summary and the sweep at 'thresholds' as lines of text for the validation report.
+    summary = evaluation['summary']
+    lines = [f'AUC : {summary["auc"]:.5f}   (per fold {summary["auc_mean"]:.5f} +- {summary["auc_std"]:.5f})',
+             f'Average precision : {summary["average_precision"]:.5f}',
+             f'Brier score : {summary["brier_score"]:.5f}   '
+             f'(per fold {summary["brier_score_mean"]:.5f} +- {summary["brier_score_std"]:.5f})',
+             f'Expected calibration error : {summary["expected_calibration_error"]:.5f}',
+             f'Best F1 : {summary["best_f1"]:.5f} above {summary["best_f1_threshold"]:.2f}']
+    sweep = evaluation['sweep']
+    for threshold in thresholds:
+        row = sweep.iloc[int(np.argmin(np.abs(sweep.index.to_numpy() - threshold)))]
+        lines.append(f'Above {row.name:.2f} : ' + ', '.join(f'{metric} {row[f"{metric}_mean"]:.5f} +- '
+                                                             f'{row[f"{metric}_std"]:.5f}' for metric in METRICS))
+    return '\n'.join(lines) + '\n'
+
+
+def _folds(scores: pd.DataFrame):
+    #  The fold of every row, 0 for a frame without a 'fold' column (e.g. the scores of risk_groups.py).
+    return scores['fold'].to_numpy() if 'fold' in scores else np.zeros(len(scores), dtype=np.int64)
+
@@ -5,164 +5,250 @@ Written      :    May 25, 2022
 Last Update  :    June 5, 2022
 """
 
+import cProfile
+import os
 import numpy as np
-import pandas as pd
 import random
 from datetime import datetime
 from time import time
 
-from bayes_net_model import make_bn
-from optimized_query import fast_query
+from compact_model import CompactModel
+from data_loader import load_compact, load_rows
+from evaluation import evaluate, report as evaluation_report, save_predictions
+from query_memo import QueryMemo
+from result_cache import ResultCache, DEFAULT_DIRECTORY
 from get_client_spreadsheet import return_client_csv
+from instrumentation import Instrumentation
+from scoring import score_test_groups, risk_group, PREDICTION_CUTOFF, MODERATE_RISK_CUTOFF
+from splitter import kfold_ids, test_indexes
 
-# we will define variables begin and end to keep track of program execution time
-begin = time()
-
-random.seed(0)
+SEED = 0
 DROP_CUTOFF = 20
-df = pd.read_csv('/media/zach/MULTIBOOT/ACS/ACST_Cust_Data.csv')
-df = df.loc[df['MissingValues'] <= DROP_CUTOFF].reset_index()
+DATA_PATH = '/media/zach/MULTIBOOT/ACS/ACST_Cust_Data.csv'
 K = 10
-NUM_ROWS = len(df)
+STRATIFY = False
+N_JOBS = 1
 TARGET_VARIABLE = 'Satisfied'
+OUTPUT_DIRECTORY = 'Client_Spreadsheets/'
+#  TRACE_MEMORY adds the tracemalloc peak to the report (at some cost in speed), PROFILE dumps a cProfile of the run.
+TRACE_MEMORY = False
+PROFILE = False
 
-index = list(range(len(df)))
-random_sample = df.iloc[np.array(random.sample(index, NUM_ROWS))]
-sample_index = random_sample.index
-
-'''
-We let n = length of index mod k.  That is, if we split the random sample into k equal sized groups,
-there will be n < k remaining unassigned elements in the sample.  So we remove the last n elements from 
-index, split index into k equal sized groups then assign the remaining n elements to the first n of the 
-k groups.
-'''
-n = NUM_ROWS % K
-remaining_indices = sample_index[NUM_ROWS - n:]
-mod_sample_index = sample_index[: NUM_ROWS - n]
-test_group_indexes = np.split(np.array(mod_sample_index), K)
-for i in range(n):
-    test_group_indexes[i] = np.append(test_group_indexes[i], (remaining_indices[i]))
-
+'''  AS CURRENTLY IMPLEMENTED, THIS PROGRAM WILL FAIL FOR LESS THAN 3 NODE BNs!!!!
 '''
-We get a list of the training group indexes by removing the 
-indexes associated with the ith testing group from the list of indices of
-the full data set
-'''
-
-# train_group_indexes is an array of length k which contains the index for each training group
-train_group_indexes = [sample_index.drop(test_group_indexes[i]) for i in range(K)]
-training_groups = [df.iloc[train_group_indexes[i]] for i in range(K)]
-
-''' 
-for each training group we have to train a new BN.  Then we will query that BN for each member
-of the associated testing group and compare its max likelihood prediction against the true value.
-'''
-
-'''  AS CURRENTLY IMPLEMENTED, THIS PROGRAM WILL FAIL FOR LESS THAN 3 NODE BNs!!!!  
-'''
-bayesian_networks = []
-for i in range(K):
-    bn = make_bn(training_groups[i], [('Var1', 'Target'),
-                                      ('Var2', 'Target'),
-                                      ('MissingValues', 'Target'),
-                                      ('Product', 'Target'),
-                                      ('Target', 'Var3_grouped'),
-                                      ('Target', 'Var4_grouped'),
-                                      ('Target', 'BinVar1'),
-                                      ('Target', 'BinVar2'),
-                                      ('Target', 'BinVar3')])
-    bayesian_networks.append(bn)
-
-'''
-Now we have to create a VariableElimination object from each BayesianNetwork object in order
-to do inference (we need to run queries).
-'''
-
-test_groups = [df.iloc[test_group_indexes[i]] for i in range(K)]
-test_group_sizes = np.array([elem.size for elem in test_group_indexes])
-train_group_sizes = np.array([elem.size for elem in train_group_indexes])
-
-environment_variables = [variable for variable in bayesian_networks[0]]
-environment_variables.remove(TARGET_VARIABLE)
-
-''' 
-The function fast_query will query all of the bayesian networks with the whole environment
-map and map the queries to their respective outputs, reducing computation time by 
-eliminating repeat calculations.
-'''
-
-fq, num_queries, method_used, external_errors = fast_query(bayesian_networks,
-                                                           test_group_indexes,
-                                                           environment_variables,
-                                                           df,
-                                                           TARGET_VARIABLE)
-
-validations = []
-high_risk_group = []
-moderate_risk_group = []
-false_negatives = []
-error_count = 0
-for i in range(K):
-    validation = []
-    false_negative_lst = []
-    for j in range(test_group_sizes[i]):
-        #  'state_instantiation' is a Series from which we can obtain the instantiated state variables.
-        state_instantiation = test_groups[i].iloc[j][environment_variables]
-        #  'client_ID is the ID in the dataset of the row we are currently investigating
-        client_ID = test_groups[i].iloc[j]['ID']
-        #  'prediction' is the max likelihood state of the target variable given the states of the other variables.
-        prediction = fq[i].loc[tuple(state_instantiation.values)]['0_y']
-        #  'actual_target_value' is the true value of the state variable we are trying to predict.
-        actual_target_value = test_groups[i].iloc[j][TARGET_VARIABLE]
-        try:
-            validation.append((prediction > .5) == actual_target_value)
-            if (prediction < .60) and (prediction > .5) and actual_target_value:
-                moderate_risk_group.append((client_ID, prediction))
-            elif not round(prediction) and actual_target_value:
-                false_negative_lst.append(client_ID)
-                high_risk_group.append((client_ID, prediction))
-        except (ValueError, TypeError) as e:
-            error_count += 1
-            print(e)
-    false_negatives.append(false_negative_lst)
-    validations.append(np.array(validation))
-#  rc_sizes is the number of false negatives in each testing group which we use in an error computation later.
-rc_sizes = np.array([len(lst) for lst in false_negatives])
-# data_on_risky_clients = df.loc[df['ID'].isin(risky_clients)]
-
-
-"""                             ERROR CALCULATION                           """
-num_correct_predictions = np.array([np.sum(validation) for validation in validations])
-group_prediction_accuracies = num_correct_predictions / (test_group_sizes - error_count)
-group_prediction_accuracies_fn = num_correct_predictions / (test_group_sizes - rc_sizes - error_count)
-mean_fn = np.mean(group_prediction_accuracies_fn)
-std_fn = np.std(group_prediction_accuracies_fn)
-mean = np.mean(group_prediction_accuracies)
-std = np.std(group_prediction_accuracies)
-
-"""                             REPORT PRINTING                             """
-date_stamp = datetime.now()
-end = time()
-bn = bayesian_networks[0]
-file_name = return_client_csv(high_risk_lst=high_risk_group,
-                              moderate_risk_lst=moderate_risk_group,
-                              data_frame=df)
-report = f'###################################################      {file_name}      {date_stamp}      >{DROP_CUTOFF} MissingValues dropped!!!   ##################################################\n\n' \
-         f'Method Used : {method_used}\n' \
-         f'Prediction Accuracy : {round(mean, 5)}\n' \
-         f'Standard Deviation : {round(std, 5)}\n' \
-         f'Accuracy without "false negatives" : {round(mean_fn, 5)}\n' \
-         f'Standard Deviation without "false negatives" : {round(std_fn, 5)}\n' \
-         f'Execution Time : {round(((end - begin) / 60), 2)} minutes\n' \
-         f'The network was queried {num_queries} times.  FastQuery saved {len(df) - num_queries} redundant queries.\n' \
-         f'Error count : {error_count + external_errors}\n' \
-         f'Nodes : {bn.nodes}\n' \
-         f'Edges : {bn.edges}\n' \
-         f'In Degree : {bn.in_degree}\n' \
-         f'Out Degree : {bn.out_degree}\n' \
-         f'States : {bn.states}\n\n\n\n'
-print(report)
-with open('BN_testing_new_query_evidence_style.txt', 'a') as file:
-    file.write('\n\n' + report)
-with open(f'Client_Spreadsheets/{file_name}/{file_name}.txt', 'w+') as file:
-    file.write(report)
+EDGES = [('Var1', 'Target'),
+         ('Var2', 'Target'),
+         ('MissingValues', 'Target'),
+         ('Product', 'Target'),
+         ('Target', 'Var3_grouped'),
+         ('Target', 'Var4_grouped'),
+         ('Target', 'BinVar1'),
+         ('Target', 'BinVar2'),
+         ('Target', 'BinVar3')]
+
+
+def kfold_validation(data_path=DATA_PATH, edges=EDGES, target=TARGET_VARIABLE, k=K, seed=SEED,
+                     drop_cutoff=DROP_CUTOFF, stratify=STRATIFY, n_jobs=N_JOBS, prediction_cutoff=PREDICTION_CUTOFF,
+                     moderate_risk_cutoff=MODERATE_RISK_CUTOFF, output_directory=OUTPUT_DIRECTORY,
+                     cache_directory=DEFAULT_DIRECTORY, trace_memory=TRACE_MEMORY, profile=PROFILE):
+    """                                 FUNCTION kfold_validation
+       __________________________________________________________________________________________
+         Cross-validates the network given by 'edges' on the .csv or .parquet file at
+         'data_path', writes the client spreadsheets, the report and its .json sidecar to a new
+         folder of 'output_directory' and returns a dict holding the report, the 'scores' frame
+         (see scoring.py), the folder's name and the accuracy figures.  The module constants are
+         the defaults, see cli.py for the command line.
+
+         pgmpy is only imported when the networks have to be trained, a run whose networks and
+         lookup tables are in the cache at 'cache_directory' never imports it.
+       __________________________________________________________________________________________"""
+    # we will define variables begin and end to keep track of program execution time
+    begin = time()
+    random.seed(seed)
+
+    '''
+    Every stage below is timed by 'instruments' (see instrumentation.py).  Its timers, counters, query latencies
+    and peak memory are added to the report and written to a .json file next to it.
+    '''
+    instruments = Instrumentation(trace_memory=trace_memory)
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        #  The nodes of the network, in the order BayesianNetwork lists them.
+        nodes = list(dict.fromkeys(node for edge in edges for node in edge))
+
+        '''
+        Only the ID and the network's variables are read.  Each variable is encoded once as a sorted Categorical
+        (see data_loader.py) and 'states' holds the sorted states of every variable.  The other columns are only
+        read for the clients in the risk groups, when their spreadsheets are written.
+        '''
+        row_filter = lambda chunk: chunk['MissingValues'] <= drop_cutoff
+        with instruments.timer('load'):
+            df, states = load_compact(data_path, nodes, row_filter=row_filter)
+        num_rows = len(df)
+        instruments.count('rows', num_rows)
+
+        '''
+        'fold_ids' gives the testing group of every row (see splitter.py).  The rows are shuffled with 'seed' and cut
+        into k equal sized groups, the n = num_rows mod k remaining rows being assigned to the first n groups.  With
+        'stratify' every testing group has the same proportion of each target class.  Training groups are never
+        materialized, the ith one is every row whose fold id is not i.
+        '''
+        with instruments.timer('split'):
+            fold_ids = kfold_ids(num_rows, k, seed=seed, stratify=df[target].to_numpy() if stratify else None)
+            test_group_indexes = test_indexes(fold_ids, k)
+
+        '''
+        for each training group we have to train a new BN.  Then we will query that BN for each member
+        of the associated testing group and compare its max likelihood prediction against the true value.
+        The family counts of every node are computed once for each testing group, and the CPTs of the ith
+        training group are built from (total counts - counts of the ith testing group).
+        '''
+
+        test_groups = (df.iloc[test_group_indexes[i]] for i in range(k))
+        test_group_sizes = np.array([elem.size for elem in test_group_indexes])
+
+        #  The environment variables are the nodes of the network minus the target.
+        environment_variables = list(nodes)
+        environment_variables.remove(target)
+
+        '''
+        run_kfold trains the bayesian networks and then the function fast_query will query all of them with
+        the whole environment map and map the queries to their respective outputs, reducing computation time by
+        eliminating repeat calculations.  With n_jobs > 1 the folds are run in parallel processes.
+        'memo' lets the folds reuse each other's answers when the relevant CPT parameters agree.
+        '''
+        memo = QueryMemo()
+
+        '''
+        Networks and lookup tables are cached on disk under a key made from the data file's contents and every
+        setting that changes them, so a rerun that only changes post-processing (e.g. the risk cutoffs) skips
+        training and inference entirely.  Cached networks are loaded as CompactModels (see compact_model.py).
+        '''
+        cache = ResultCache(cache_directory)
+        cache_key = ResultCache.make_key(data_path, edges, seed, k, target=target, drop_cutoff=drop_cutoff,
+                                         num_rows=num_rows, stratify=stratify)
+        with instruments.timer('cache_load'):
+            cached_run = cache.load(cache_key, compact=True)
+        if cached_run is None:
+            #  Training imports pgmpy, which is why it is imported here.
+            from parallel_kfold import run_kfold
+            with instruments.timer('training_and_inference'):
+                bayesian_networks, fq, num_queries, method_used, external_errors = run_kfold(df,
+                                                                                             edges,
+                                                                                             test_group_indexes,
+                                                                                             environment_variables,
+                                                                                             target,
+                                                                                             n_jobs=n_jobs,
+                                                                                             memo=memo,
+                                                                                             instruments=instruments)
+            with instruments.timer('cache_store'):
+                cache.store(cache_key, bayesian_networks, fq, num_queries, method_used, external_errors)
+        else:
+            bayesian_networks, fq, num_queries, method_used, external_errors = cached_run
+
+        '''
+        Every testing group is joined to its lookup table in one merge.  'scores' has one row per test row with
+        its fold, prediction, correctness and risk tier (see scoring.py).
+        '''
+        with instruments.timer('scoring'):
+            scores = score_test_groups(test_groups, fq, environment_variables, target,
+                                       prediction_cutoff, moderate_risk_cutoff)
+            scores_by_fold = scores.groupby('fold')
+            high_risk_group = risk_group(scores, 'high_risk')
+            moderate_risk_group = risk_group(scores, 'moderate_risk')
+        error_count = int(scores['error'].sum())
+        #  rc_sizes is the number of false negatives in each testing group which we use in an error computation later.
+        rc_sizes = scores_by_fold['high_risk'].sum().reindex(range(k), fill_value=0).to_numpy()
+
+        """                             ERROR CALCULATION                           """
+        num_correct_predictions = scores_by_fold['correct'].sum().reindex(range(k), fill_value=0).to_numpy()
+        group_prediction_accuracies = num_correct_predictions / (test_group_sizes - error_count)
+        group_prediction_accuracies_fn = num_correct_predictions / (test_group_sizes - rc_sizes - error_count)
+        mean_fn = np.mean(group_prediction_accuracies_fn)
+        std_fn = np.std(group_prediction_accuracies_fn)
+        mean = np.mean(group_prediction_accuracies)
+        std = np.std(group_prediction_accuracies)
+
+        '''
+        The out-of-fold probabilities of every row are kept in a _predictions.csv file next to the report, the threshold
+        sweep, ROC and calibration figures below are computed from them (see evaluation.py), and other cutoffs can be
+        tried on that file with cli.py evaluate and scoring.rescore without training or querying again.
+        '''
+        with instruments.timer('evaluation'):
+            evaluation = evaluate(scores)
+
+        """                             REPORT PRINTING                             """
+        date_stamp = datetime.now()
+        end = time()
+        bn = bayesian_networks[0]
+        with instruments.timer('spreadsheets'):
+            client_rows = load_rows(data_path, [client for client, _ in high_risk_group + moderate_risk_group],
+                                    row_filter=row_filter)
+            file_name = return_client_csv(high_risk_lst=high_risk_group,
+                                          moderate_risk_lst=moderate_risk_group,
+                                          data_frame=client_rows,
+                                          parent_directory=output_directory)
+        folder = os.path.join(output_directory, file_name)
+        save_predictions(os.path.join(folder, f'{file_name}_predictions.csv'), scores)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(folder, f'{file_name}.prof'))
+        report = f'###################################################      {file_name}      {date_stamp}      >{drop_cutoff} MissingValues dropped!!!   ##################################################\n\n' \
+                 f'Method Used : {method_used}\n' \
+                 f'Prediction Accuracy : {round(mean, 5)}\n' \
+                 f'Standard Deviation : {round(std, 5)}\n' \
+                 f'Accuracy without "false negatives" : {round(mean_fn, 5)}\n' \
+                 f'Standard Deviation without "false negatives" : {round(std_fn, 5)}\n' \
+                 f'Execution Time : {round(((end - begin) / 60), 2)} minutes\n' \
+                 f'The network was queried {num_queries} times.  FastQuery saved {len(df) - num_queries} redundant queries.  Memo hits : {memo.hits}, misses : {memo.misses}.\n' \
+                 f'Error count : {error_count + external_errors}\n' \
+                 f'{evaluation_report(evaluation, (prediction_cutoff, moderate_risk_cutoff))}' \
+                 f'{network_description(bn)}' \
+                 f'{instruments.report()}\n\n\n'
+        print(report)
+        with open('BN_testing_new_query_evidence_style.txt', 'a') as file:
+            file.write('\n\n' + report)
+        with open(os.path.join(folder, f'{file_name}.txt'), 'w+') as file:
+            file.write(report)
+        instruments.write_json(os.path.join(folder, f'{file_name}.json'),
+                               execution_seconds=end - begin,
+                               prediction_accuracy=mean,
+                               standard_deviation=std,
+                               num_queries=num_queries,
+                               error_count=error_count + external_errors,
+                               evaluation=evaluation['summary'])
+        return {'file_name': file_name,
+                'report': report,
+                'scores': scores,
+                'prediction_accuracy': mean,
+                'standard_deviation': std,
+                'num_queries': num_queries,
+                'error_count': error_count + external_errors,
+                'evaluation': evaluation}
+    finally:
+        #  Tracing started for this run is stopped, the caller (e.g. a job scheduler) may go on running.
+        instruments.close()
+        if profiler is not None:
+            profiler.disable()
+
+
+def network_description(bn):
+    #  The Nodes, Edges, In Degree, Out Degree and States lines of a report, for a BayesianNetwork or a CompactModel.
+    if not isinstance(bn, CompactModel):
+        return f'Nodes : {bn.nodes}\n' \
+               f'Edges : {bn.edges}\n' \
+               f'In Degree : {bn.in_degree}\n' \
+               f'Out Degree : {bn.out_degree}\n' \
+               f'States : {bn.states}\n'
+    edges = [(node, child) for node in bn.nodes for child in bn.nodes if node in bn.parents(child)]
+    return f'Nodes : {list(bn.nodes)}\n' \
+           f'Edges : {edges}\n' \
+           f'In Degree : {[(node, len(bn.parents(node))) for node in bn.nodes]}\n' \
+           f'Out Degree : {[(node, sum(parent == node for parent, _ in edges)) for node in bn.nodes]}\n' \
+           f'States : {({node: list(range(card)) for node, card in bn.cardinality().items()})}\n'
+
+
+if __name__ == '__main__':
+    kfold_validation()
@@ -2,9 +2,26 @@ import os
 import pandas as pd
 from funnynames import get_random_file_name
 
+#  The file formats return_client_csv can write, and the extension of each.
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
 
-def return_client_csv(high_risk_lst: list, moderate_risk_lst: list, data_frame: pd.DataFrame):
-    parent_directory = 'Client_Spreadsheets/'
+
+def return_client_csv(high_risk_lst: list, moderate_risk_lst: list, data_frame: pd.DataFrame,
+                      parent_directory='Client_Spreadsheets/', file_format='csv'):
+    """                                 FUNCTION return_client_csv
+       __________________________________________________________________________________________
+         Writes the rows of 'data_frame' of the clients in each risk list, with the probability
+         that they are satisfied inserted after the ID column, to a new randomly named directory
+         of 'parent_directory' and returns the name of that directory.
+
+         high_risk_lst      -   (ID, probability) pairs, as returned by scoring.risk_group.
+         moderate_risk_lst  -   The same for the moderate risk group.
+         file_format        -   'csv', or 'parquet' / 'feather' for large risk groups (these
+                                require pyarrow).
+       __________________________________________________________________________________________"""
+    if file_format not in EXTENSIONS:
+        raise ValueError(f"Unknown file format '{file_format}', expected one of {list(EXTENSIONS)}")
+    os.makedirs(parent_directory, exist_ok=True)
     while True:
         try:
             directory = get_random_file_name()
@@ -14,37 +31,24 @@ def return_client_csv(high_risk_lst: list, moderate_risk_lst: list, data_frame:
         except FileExistsError:
             pass
 
-    moderate_risk_df = data_frame.loc[data_frame['ID'].isin([e[0] for e in moderate_risk_lst])].copy()
-    insert_column_index = moderate_risk_df.columns.to_list().index('ID') + 1
-    moderate_risk_df.insert(insert_column_index, 'Probability_Satisfied', -1)
-    for i in range(len(moderate_risk_df['ID'].unique())):
-        try:
-            # find the row with a particular ID value
-            row_indexes = data_frame.index[data_frame['ID'] == moderate_risk_lst[i][0]]
-            # then insert the probability the customer with that ID is satisfied in the appropriate column
-            for index in row_indexes:
-                moderate_risk_df.loc[index, 'Probability_Satisfied'] = moderate_risk_lst[i][1]
-        except IndexError:
-            print("i: ", i)
+    for risk_lst, group in ((moderate_risk_lst, 'moderate_risk_group'), (high_risk_lst, 'high_risk_group')):
+        risk_df = _with_probabilities(data_frame, risk_lst)
+        complete_name = os.path.join(path, f'{directory}_{group}{EXTENSIONS[file_format]}')
+        #  pandas writes straight to the file, in chunks for csv, instead of building the output in memory.
+        if file_format == 'csv':
+            risk_df.to_csv(complete_name, index=False)
+        elif file_format == 'parquet':
+            risk_df.to_parquet(complete_name, index=False)
+        else:
+            risk_df.to_feather(complete_name)
+    return directory
 
-    high_risk_df = data_frame.loc[data_frame['ID'].isin([e[0] for e in high_risk_lst])].copy()
-    insert_column_index = high_risk_df.columns.to_list().index('ID') + 1
-    high_risk_df.insert(insert_column_index, 'Probability_Satisfied', -1)
-    for i in range(len(high_risk_df['ID'].unique())):
-        # find the row with a particular ID value
-        row_indexes = data_frame.index[data_frame['ID'] == high_risk_lst[i][0]]
-        # then insert the probability the customer with that ID is satisfied in the appropriate column
-        for index in row_indexes:
-            high_risk_df.loc[index, 'Probability_Satisfied'] = high_risk_lst[i][1]
 
-    save_path = 'Client_Spreadsheets/' + directory
-    file_name_1 = directory + '_moderate_risk_group.csv'
-    file_name_2 = directory + '_high_risk_group.csv'
-    complete_name_1 = os.path.join(save_path, file_name_1)
-    complete_name_2 = os.path.join(save_path, file_name_2)
-    with open(complete_name_1, 'w') as file1, open(complete_name_2, 'w') as file2:
-        csv1 = moderate_risk_df.to_csv(index=False)
-        file1.write(csv1)
-        csv2 = high_risk_df.to_csv(index=False)
-        file2.write(csv2)
-    return directory
+def _with_probabilities(data_frame: pd.DataFrame, risk_lst: list):
+    #  The rows of 'data_frame' whose ID is in 'risk_lst', in their original order, joined to their probability on ID.
+    probabilities = pd.DataFrame(risk_lst, columns=['ID', 'Probability_Satisfied']).drop_duplicates('ID')
+    probabilities['ID'] = probabilities['ID'].astype(data_frame['ID'].dtype)
+    risk_df = pd.merge(data_frame, probabilities, how='inner', on='ID', validate='many_to_one')
+    columns = data_frame.columns.to_list()
+    columns.insert(columns.index('ID') + 1, 'Probability_Satisfied')
+    return risk_df[columns]
@@ -0,0 +1,143 @@
+"""
+A trained network that keeps the family counts it was built from, so it can be updated in place.
+
+When new customer rows arrive (or old ones are removed), only the family counts are updated and only
+the CPTs whose counts changed are re-derived, so a refresh costs time proportional to the size of the
+delta instead of the size of the history.  Cached posteriors that depend on a re-derived CPT (memo
+entries and compiled posterior tables) are invalidated; the others are kept.
+"""
+import numpy as np
+
+from bayes_net_model import network_structure, bn_from_cpds
+from compiled_inference import CompiledPosterior
+from cpdmaker import count_configurations, cpd_from_counts
+from data_loader import category_codes
+from sufficient_stats import encode_columns, stream_family_counts
+
+
+class CountModel:
+    """                                 CLASS CountModel
+       __________________________________________________________________________________________
+         Use CountModel.fit (or from_file) rather than the constructor.  'bn' is the pgmpy
+         BayesianNetwork kept in sync with 'family_counts', whose ith element is the count tensor
+         of the family of nodes[i] with shape (card_node, card_parent_1, ..., card_parent_n).
+
+         memo               -   An optional QueryMemo whose stale entries are dropped on update.
+         targets            -   Variables for which a CompiledPosterior is kept up to date, they
+                                are found in 'compiled'.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, edges: list, states: dict, family_counts: list, pseudocount=0, memo=None, targets=()):
+        self.edges = edges
+        self.nodes, self.parents_of_node = network_structure(edges)
+        self.states = states
+        self.family_counts = family_counts
+        self.pseudocount = pseudocount
+        self.memo = memo
+        cpds = [cpd_from_counts(counts, pseudocount) for counts in family_counts]
+        self.bn = bn_from_cpds(edges, self.nodes, self.parents_of_node, self._cardinalities(), cpds)
+        self.compiled = {target: CompiledPosterior(self.bn, target) for target in targets}
+
+    @classmethod
+    def fit(cls, data_frame, edges: list, pseudocount=0, memo=None, targets=()):
+        nodes, parents_of_node = network_structure(edges)
+        codes, states = encode_columns(data_frame, nodes)
+        family_counts = [count_configurations([codes[variable] for variable in [node] + parents],
+                                              [len(states[variable]) for variable in [node] + parents])
+                         for node, parents in zip(nodes, parents_of_node)]
+        return cls(edges, states, family_counts, pseudocount, memo, targets)
+
+    @classmethod
+    def from_file(cls, path, edges: list, row_filter=None, pseudocount=0, memo=None, targets=()):
+        #  Like fit, but streams the .csv or .parquet file at 'path' (see stream_family_counts).
+        nodes, parents_of_node = network_structure(edges)
+        states, family_counts = stream_family_counts(path, nodes, parents_of_node, row_filter=row_filter)
+        return cls(edges, states, [counts[0] for counts in family_counts], pseudocount, memo, targets)
+
+    def _cardinalities(self):
+        return {node: len(self.states[node]) for node in self.nodes}
+
+    def update(self, added=None, removed=None):
+        """                                 METHOD update
+           __________________________________________________________________________________________
+             Adds the rows of the DataFrame 'added' to the counts and subtracts those of 'removed',
+             then re-derives the CPT of every node whose family counts changed.  States never seen
+             before are inserted in sorted position, which changes the CPTs of every family that
+             contains them.  Returns the set of nodes whose CPTs were re-derived.
+
+             A ValueError is raised, and nothing is changed, if 'removed' contains a state the model
+             does not have or rows it was never trained on.
+           __________________________________________________________________________________________"""
+        if removed is not None:
+            for variable in self.nodes:
+                if np.any(category_codes(removed[variable], self.states[variable]) < 0):
+                    raise ValueError(f'Removed rows contain a state of {variable} the model has never seen')
+
+        #  New states are inserted into copies of the states and counts, which replace them once every delta is checked.
+        states = dict(self.states)
+        family_counts = list(self.family_counts)
+        changed = set()
+        if added is not None:
+            for variable in self.nodes:
+                new_states = set(added[variable].unique()) - set(states[variable])
+                if new_states:
+                    changed |= self._insert_states(variable, new_states, states, family_counts)
+
+        deltas = [np.zeros_like(counts) for counts in family_counts]
+        for rows, sign in ((added, 1), (removed, -1)):
+            if rows is None or len(rows) == 0:
+                continue
+            codes = {variable: category_codes(rows[variable], states[variable]) for variable in self.nodes}
+            for delta, node, parents in zip(deltas, self.nodes, self.parents_of_node):
+                family = [node] + parents
+                delta += sign * count_configurations([codes[variable] for variable in family], delta.shape)
+        if any(np.any(counts + delta < 0) for counts, delta in zip(family_counts, deltas)):
+            raise ValueError('Removed rows were never counted by the model')
+
+        self.states = states
+        self.family_counts = family_counts
+        for i, delta in enumerate(deltas):
+            if np.any(delta):
+                self.family_counts[i] = self.family_counts[i] + delta
+                changed.add(self.nodes[i])
+        self._rederive(changed)
+        return changed
+
+    def _insert_states(self, variable, new_states, states, family_counts):
+        #  Inserts 'new_states' into the sorted 'states' of 'variable', padding the 'family_counts' containing it.
+        old_states = states[variable]
+        states[variable] = sorted(set(old_states) | set(new_states))
+        positions = np.searchsorted(states[variable], old_states)
+
+        touched = set()
+        for i, (node, parents) in enumerate(zip(self.nodes, self.parents_of_node)):
+            family = [node] + parents
+            if variable not in family:
+                continue
+            axis = family.index(variable)
+            counts = family_counts[i]
+            shape = list(counts.shape)
+            shape[axis] = len(states[variable])
+            expanded = np.zeros(shape, dtype=counts.dtype)
+            index = [slice(None)] * counts.ndim
+            index[axis] = positions
+            expanded[tuple(index)] = counts
+            family_counts[i] = expanded
+            touched.add(node)
+        return touched
+
+    def _rederive(self, changed):
+        #  Rebuilds the CPTs of the 'changed' nodes and drops the cached posteriors that depend on them.
+        if not changed:
+            return
+        cardinalities = self._cardinalities()
+        cpds = [cpd_from_counts(counts, self.pseudocount) if node in changed else self.bn.get_cpds(node).get_values()
+                for node, counts in zip(self.nodes, self.family_counts)]
+        self.bn = bn_from_cpds(self.edges, self.nodes, self.parents_of_node, cardinalities, cpds)
+
+        if self.memo is not None:
+            self.memo.invalidate(changed)
+        for target in self.compiled:
+            depends_on = {cpd.variable for cpd in self.bn.get_cpds() if target in cpd.variables}
+            if depends_on & changed:
+                self.compiled[target] = CompiledPosterior(self.bn, target)
@@ -0,0 +1,156 @@
+"""
+Named timers, counters and latency samples for the stages of a run, and its peak memory.
+
+One Instrumentation object is passed down the pipeline (the 'instruments' parameters of run_kfold,
+make_kfold_bns, fold_family_counts and fast_query), every function recording what it does under
+a name such as 'cpt_counts/Var1' or 'inference/fold_3'.  Passing None records nothing.  At the end
+of a run report() gives the text for the validation report and write_json() the same figures in a
+machine-readable sidecar file.
+
+Peak memory is the maximum resident set size of the process, plus the peak of the memory traced by
+tracemalloc if trace_memory is set.  Tracing is exact for numpy and pandas allocations but slows
+Python code down, so it is off by default, and close() stops the tracing an Instrumentation started.
+"""
+import json
+import sys
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+import numpy as np
+
+
+class Instrumentation:
+    """                                 CLASS Instrumentation
+       __________________________________________________________________________________________
+         timers             -   Maps a name to the list of durations (seconds) timed under it.
+         counters           -   Maps a name to an integer.
+         latencies          -   Maps a name to a list of individual latencies (seconds), e.g.
+                                one per query, reported with their mean and 95th percentile.
+         trace_memory       -   Start tracemalloc now, unless it is already tracing, and report
+                                its peak from now on.  Call close(), or use the object as a
+                                context manager, to stop the tracing it started.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, trace_memory=False):
+        self.timers = {}
+        self.counters = {}
+        self.latencies = {}
+        self.trace_memory = trace_memory
+        self._started_tracing = False
+        self._traced_peak = None
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            tracemalloc.reset_peak()
+
+    def close(self):
+        #  Stops the tracing this object started, keeping its peak for the report.
+        if self._started_tracing:
+            self._traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def timer(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        self.timers.setdefault(name, []).append(seconds)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def sample(self, name, seconds):
+        self.latencies.setdefault(name, []).append(seconds)
+
+    def merge(self, other):
+        #  Adds the records of 'other', e.g. an Instrumentation returned by a worker process.
+        for name, durations in other.timers.items():
+            self.timers.setdefault(name, []).extend(durations)
+        for name, amount in other.counters.items():
+            self.count(name, amount)
+        for name, samples in other.latencies.items():
+            self.latencies.setdefault(name, []).extend(samples)
+
+    def __getstate__(self):
+        #  Only the records travel between processes, memory tracing belongs to the process that started it.
+        return {'timers': self.timers, 'counters': self.counters, 'latencies': self.latencies, 'trace_memory': False,
+                '_started_tracing': False, '_traced_peak': None}
+
+    def peak_memory(self):
+        #  Returns {'max_rss_bytes': ..., 'tracemalloc_peak_bytes': ...}, a figure is None where it is unavailable.
+        memory = {'max_rss_bytes': None, 'tracemalloc_peak_bytes': None}
+        try:
+            import resource
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            #  ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+            memory['max_rss_bytes'] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+        except ImportError:
+            pass
+        if tracemalloc.is_tracing():
+            memory['tracemalloc_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        elif self._traced_peak is not None:
+            memory['tracemalloc_peak_bytes'] = self._traced_peak
+        return memory
+
+    def summary(self):
+        #  Every record as a dict of plain Python values, the content of the JSON sidecar.
+        return {'timers': {name: {'calls': len(durations), 'total_seconds': sum(durations)}
+                           for name, durations in self.timers.items()},
+                'counters': dict(self.counters),
+                'latencies': {name: _latency_summary(samples) for name, samples in self.latencies.items()},
+                'memory': self.peak_memory()}
+
+    def report(self):
+        #  The summary as lines of text for the validation report.
+        summary = self.summary()
+        lines = ['Timers :']
+        lines += [f'    {name:<40} {timer["total_seconds"]:>10.3f} s   ({timer["calls"]} calls)'
+                  for name, timer in summary['timers'].items()]
+        if summary['counters']:
+            lines.append('Counters :')
+            lines += [f'    {name:<40} {amount:>10}' for name, amount in summary['counters'].items()]
+        if summary['latencies']:
+            lines.append('Latencies :')
+            lines += [f'    {name:<40} {latency["count"]:>10} samples, mean {latency["mean_ms"]:.3f} ms, '
+                      f'p95 {latency["p95_ms"]:.3f} ms' for name, latency in summary['latencies'].items()]
+        memory = summary['memory']
+        peaks = [f'{_megabytes(memory["max_rss_bytes"])} MB resident']
+        if memory['tracemalloc_peak_bytes'] is not None:
+            peaks.append(f'{_megabytes(memory["tracemalloc_peak_bytes"])} MB traced')
+        lines.append('Peak memory : ' + ', '.join(peaks))
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path, **extra):
+        #  Writes the summary, and any 'extra' figures (e.g. the accuracy), to the JSON file at 'path'.
+        with open(path, 'w') as file:
+            json.dump({**extra, **self.summary()}, file, indent=2, default=str)
+
+
+def timer(instruments, name):
+    #  instruments.timer(name), or a context that records nothing when 'instruments' is None.
+    return instruments.timer(name) if instruments is not None else nullcontext()
+
+
+def _latency_summary(samples):
+    samples = np.asarray(samples) * 1000
+    return {'count': len(samples),
+            'mean_ms': float(samples.mean()) if len(samples) else 0.0,
+            'p95_ms': float(np.percentile(samples, 95)) if len(samples) else 0.0,
+            'max_ms': float(samples.max()) if len(samples) else 0.0}
+
+
+def _megabytes(num_bytes):
+    return round(num_bytes / 2 ** 20, 1) if num_bytes is not None else '?'
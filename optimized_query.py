@@ -6,9 +6,13 @@ Last Update  :    June 18, 2022
 """
 import sys
 
+import numpy as np
 import pandas as pd
 import copy
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
 from tqdm import tqdm
+from compiled_inference import CompiledPosterior, MarkovBlanketPosterior, MissingMaskPlanner
 from pgmpy.inference.ExactInference import VariableElimination
 from pgmpy.inference.ExactInference import BeliefPropagation
 
@@ -25,7 +29,14 @@ def environment_map(data_frame, universe):
          universe           -   An iterable containing all the names (string format) of the
                                 environment variables.  Should be a subset of data_frame.columns
        __________________________________________________________________________________________"""
-    return {variable: state_mapping(data_frame[variable].unique()) for variable in universe}
+    return {variable: state_mapping(_states(data_frame[variable])) for variable in universe}
+
+
+def _states(column: pd.Series):
+    #  The categories of a Categorical column from data_loader.load_compact are already its sorted states.
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.categories
+    return column.unique()
 
 
 def state_mapping(state_space):
@@ -41,41 +52,297 @@ def state_mapping(state_space):
     return dict([(b, a) for a, b in enumerate(sorted(state_space))])
 
 
-def fast_query(bns: list, test_grp_indexes, environment_variables: list, data_frame: pd.DataFrame, target: str):
-    inferences = [VariableElimination(bn) for bn in bns]
-    env_map = environment_map(data_frame, environment_variables)
+class StatelessVariableElimination(VariableElimination):
+    """                                 CLASS StatelessVariableElimination
+       __________________________________________________________________________________________
+         VariableElimination.query() prunes the model, replaces self.model with the pruned copy
+         and re-initializes itself afterwards, which is why fast_query used to deepcopy the
+         engine before every query.  This engine builds its factors once and answers every query
+         by running the elimination on reduced copies of them, so nothing is mutated between
+         queries and a single engine can serve a whole testing group.
+
+         The elimination order only depends on which variables are observed, so it is computed
+         once per set of evidence variables and reused.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, model):
+        super().__init__(model)
+        self._initialize_structures()
+        self._elimination_orders = {}
+
+    def query(self, variables, evidence=None, show_progress=False):
+        evidence = evidence if evidence is not None else dict()
+        order_key = (tuple(variables), frozenset(evidence))
+        if order_key not in self._elimination_orders:
+            self._elimination_orders[order_key] = \
+                self._get_elimination_order(variables, evidence, 'MinFill', show_progress=False)
+        return self._variable_elimination(variables,
+                                          'marginalize',
+                                          evidence=evidence,
+                                          elimination_order=self._elimination_orders[order_key],
+                                          joint=True,
+                                          show_progress=show_progress)
+
+
+class QueryExecutor:
+    """                                 CLASS QueryExecutor
+       __________________________________________________________________________________________
+         Runs the queries fast_query cannot answer from a compiled table or the memo.  run(i,
+         evidences) queries the ith engine with every evidence dict of 'evidences' and returns,
+         in the same order, a (posterior, error, seconds) triple per query, where 'error' is the
+         IndexError or ValueError the query raised (posterior None) or None.
+
+         n_jobs             -   With n_jobs > 1 the evidences are split into chunks of
+                                'chunksize' queries which a pool of n_jobs workers answers, the
+                                results being put back in order as the chunks complete.
+         pool               -   'thread' : the workers share the engines, which are not mutated
+                                by a query (see StatelessVariableElimination).
+                                'process' : every worker process builds its own engines from the
+                                networks once, which avoids the global interpreter lock.
+
+         Use it as a context manager, the pool is started by the first run that needs it and
+         shut down on exit.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, inferences: list, method: str, target: str, n_jobs=1, pool='thread', chunksize=None,
+                 show_progress=True):
+        if pool not in ('thread', 'process'):
+            raise ValueError(f"Unknown pool '{pool}', expected 'thread' or 'process'")
+        self.inferences = inferences
+        self.deep_copy = method == 'deepcopy'
+        self.target = target
+        self.n_jobs = n_jobs
+        self.pool = pool
+        self.chunksize = chunksize
+        self.show_progress = show_progress
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def run(self, i, evidences: list, desc=''):
+        progress = tqdm(total=len(evidences), desc=desc, colour='GREEN', disable=not self.show_progress)
+        if self.n_jobs <= 1 or len(evidences) < 2:
+            results = []
+            for evidence in evidences:
+                results += _answer_queries(self.inferences[i], self.deep_copy, self.target, [evidence])
+                progress.update()
+            progress.close()
+            return results
+
+        chunksize = self.chunksize or max(1, min(256, -(-len(evidences) // (4 * self.n_jobs))))
+        chunks = [evidences[start:start + chunksize] for start in range(0, len(evidences), chunksize)]
+        if self._executor is None:
+            if self.pool == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.n_jobs)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.n_jobs, initializer=_init_query_worker,
+                                                     initargs=([inference.model for inference in self.inferences],
+                                                               self.deep_copy, self.target))
+        if self.pool == 'thread':
+            futures = [self._executor.submit(_answer_queries, self.inferences[i], self.deep_copy, self.target, chunk)
+                       for chunk in chunks]
+        else:
+            futures = [self._executor.submit(_worker_answer_queries, i, chunk) for chunk in chunks]
+        results = []
+        for chunk, future in zip(chunks, futures):
+            results += future.result()
+            progress.update(len(chunk))
+        progress.close()
+        return results
+
+
+def _answer_queries(inference, deep_copy: bool, target: str, evidences: list):
+    #  The (posterior, error, seconds) of every query, the errors fast_query counts are returned instead of raised.
+    results = []
+    for evidence in evidences:
+        query_start = perf_counter()
+        try:
+            engine = copy.deepcopy(inference) if deep_copy else inference
+            posterior = engine.query([target], evidence, show_progress=False).values[1]
+            results.append((posterior, None, perf_counter() - query_start))
+        except (IndexError, ValueError) as e:
+            results.append((None, e, perf_counter() - query_start))
+    return results
+
+
+#  State shared by the functions below inside a query worker process, set once by _init_query_worker.
+_query_worker = {}
+
+
+def _init_query_worker(bns, deep_copy, target):
+    _query_worker['bns'] = bns
+    _query_worker['inferences'] = {}
+    _query_worker['deep_copy'] = deep_copy
+    _query_worker['target'] = target
+
+
+def _worker_answer_queries(i, evidences):
+    inferences = _query_worker['inferences']
+    if i not in inferences:
+        bn = _query_worker['bns'][i]
+        inferences[i] = VariableElimination(bn) if _query_worker['deep_copy'] else StatelessVariableElimination(bn)
+    return _answer_queries(inferences[i], _query_worker['deep_copy'], _query_worker['target'], evidences)
+
+
+def fast_query(bns: list, test_grp_indexes, environment_variables: list, data_frame: pd.DataFrame, target: str,
+               method='stateless', env_map=None, show_progress=True, memo=None, instruments=None,
+               fold_offset=0, n_jobs=1, pool='thread', chunksize=None):
+    """
+    'method' chooses the inference engine.  'stateless' (default) creates one
+    StatelessVariableElimination per network and queries it directly.  'deepcopy' is the original
+    behaviour of deep copying a VariableElimination object before every query.  'compiled' builds
+    a CompiledPosterior per network and answers every query whose Markov blanket is fully observed
+    with one gather, falling back to the stateless engine for the rest.  'markov_blanket' multiplies
+    the factors that mention the target for every evidence combination at once, in log space,
+    without a table over the whole blanket, and also answers combinations whose missing variables
+    are childless children of the target (see MarkovBlanketPosterior).  Both return exactly what
+    the pgmpy engines return.  'planner' groups the evidence combinations by which variables are
+    missing ('N'), sums those variables out once per group and answers the whole group with one
+    gather (see MissingMaskPlanner), so the cost grows with the number of missing-value patterns
+    instead of the number of combinations.
+
+    'env_map' may be passed when 'data_frame' does not contain every state of the environment
+    (e.g. a single testing group), otherwise it is computed from 'data_frame'.
+
+    'memo' is an optional QueryMemo (see query_memo.py).  Pass the same memo to every call, or
+    networks of several folds in one call, to reuse posteriors across folds.
+
+    'instruments' is an optional Instrumentation (see instrumentation.py).  The ith network's
+    queries are timed as 'inference/fold_<i>', every query that is not answered by the compiled
+    table is sampled in 'query_latency/fold_<i>' and the number of queries and errors counted.
+    'fold_offset' is added to i, for callers that query the folds one at a time.
+
+    'n_jobs', 'pool' and 'chunksize' run the queries of each network that the compiled table and
+    the memo cannot answer in a pool of n_jobs threads or processes, in chunks of 'chunksize'
+    queries (see QueryExecutor), so that a single large testing group can use every core.  The
+    results are assembled in order and the errors are counted exactly as in a serial run.
+    """
+    compiled = [None] * len(bns)
+    if method in ('stateless', 'compiled', 'markov_blanket', 'planner'):
+        inferences = [StatelessVariableElimination(bn) for bn in bns]
+    elif method == 'deepcopy':
+        inferences = [VariableElimination(bn) for bn in bns]
+    else:
+        raise ValueError(f"Unknown method '{method}', expected 'stateless', 'deepcopy', 'compiled', 'markov_blanket' or 'planner'")
+    if method == 'compiled':
+        try:
+            compiled = [CompiledPosterior(bn, target) for bn in bns]
+        except ValueError as e:
+            print(f'{e}, falling back to stateless queries.')
+    if method == 'markov_blanket':
+        compiled = [MarkovBlanketPosterior.from_network(bn, target) for bn in bns]
+    if method == 'planner':
+        compiled = [MissingMaskPlanner.from_network(bn, target) for bn in bns]
+    if env_map is None:
+        env_map = environment_map(data_frame, environment_variables)
+    keyers = [memo.keyer(bn, target) for bn in bns] if memo is not None else [None] * len(bns)
     quick_lookup_tables = []
     error_count = 0
-    for i in range(len(inferences)):
-        df = data_frame.iloc[test_grp_indexes[i]]
-        groupby = df.groupby(environment_variables[:-1])[environment_variables[-1]]
-        multi_index = groupby.value_counts().index
-        query_evidence_table = pd.DataFrame(multi_index)
-
-        for j in tqdm(range(query_evidence_table.size),
-                      desc=f'Testing group {i+1} of {len(inferences)} : ',
-                      colour='GREEN'):
-            query_evidence = \
-                {v: env_map[v][s] for v, s in zip(environment_variables,
-                                                  query_evidence_table.loc[j][0])
-                 if s != 'N'}
-            try:
-                inference = copy.deepcopy(inferences[i])
-                inference = inference.query([target], query_evidence, show_progress=False)
-                query_evidence_table.loc[j][0] = inference.values[1]
-            except IndexError as e:
-                """ For the time being if this happens we will predict 'satisfied.' """
-                query_evidence_table.loc[j][0] = 1.0
-                error_count += 1
-                print(e)
-            except ValueError as e:
-                print(f'query_evidence : {query_evidence}')
-                error_count += 1
-                print(e)
-
-        mymap = pd.DataFrame(range(len(multi_index)), index=multi_index)
-        quick_lookup = pd.merge(mymap, query_evidence_table, left_on=mymap.columns[0], right_index=True)
-        quick_lookup_tables.append(quick_lookup)
+    with QueryExecutor(inferences, method, target, n_jobs, pool, chunksize, show_progress) as executor:
+        for i in range(len(inferences)):
+            fold_start, fold_errors = perf_counter(), error_count
+            df = data_frame.iloc[test_grp_indexes[i]]
+            groupby = df.groupby(environment_variables[:-1], observed=True)[environment_variables[-1]]
+            #  value_counts of a Categorical column also lists the states that do not occur, we only keep those that do.
+            evidence_counts = groupby.value_counts()
+            multi_index = evidence_counts[evidence_counts > 0].index
+            query_evidence_table = pd.DataFrame(multi_index)
+
+            column = query_evidence_table[0].to_numpy(dtype=object)
+            pending = range(len(column))
+            if compiled[i] is not None:
+                answered, posteriors = compiled_answers(compiled[i], multi_index, environment_variables, env_map)
+                column[answered] = posteriors
+                pending = np.flatnonzero(~answered)
+
+            #  The memo is only read and written here, the queries it cannot answer are run by the executor.
+            lookups = {}
+            first_of_key = {}
+            for j in pending:
+                lookup_start = perf_counter()
+                query_evidence = {v: env_map[v][s] for v, s in zip(environment_variables, column[j]) if s != 'N'}
+                key = keyers[i].key(query_evidence) if memo is not None else None
+                if key in first_of_key:
+                    #  The same query as an earlier combination, whose result reaches the memo only after the executor runs.
+                    source, posterior = first_of_key[key], None
+                else:
+                    source, posterior = j, memo.get(key) if key is not None else None
+                    if posterior is None and key is not None:
+                        first_of_key[key] = j
+                lookups[j] = (query_evidence, key, source, posterior, perf_counter() - lookup_start)
+
+            to_query = [j for j, (_, _, source, posterior, _) in lookups.items() if source == j and posterior is None]
+            results = dict(zip(to_query, executor.run(i, [lookups[j][0] for j in to_query],
+                                                      desc=f'Testing group {i+1} of {len(inferences)} : ')))
+            for j, (query_evidence, key, source, posterior, latency) in lookups.items():
+                if posterior is None:
+                    posterior, error, query_seconds = results[source]
+                    latency += query_seconds if source == j else 0
+                    if source != j:
+                        #  Counted as the lookup the serial loop makes once the first query has stored its result.
+                        if error is None:
+                            memo.hits += 1
+                        else:
+                            memo.misses += 1
+                    if isinstance(error, IndexError):
+                        """ For the time being if this happens we will predict 'satisfied.' """
+                        posterior = 1.0
+                        error_count += 1
+                        print(error)
+                    elif error is not None:
+                        print(f'query_evidence : {query_evidence}')
+                        error_count += 1
+                        print(error)
+                        posterior = None
+                    elif key is not None and source == j:
+                        memo.put(key, posterior)
+                if posterior is not None:
+                    column[j] = posterior
+                if instruments is not None:
+                    instruments.sample(f'query_latency/fold_{i + fold_offset}', latency)
+            query_evidence_table[0] = column
+
+            mymap = pd.DataFrame(range(len(multi_index)), index=multi_index)
+            quick_lookup = pd.merge(mymap, query_evidence_table, left_on=mymap.columns[0], right_index=True)
+            quick_lookup_tables.append(quick_lookup)
+            if instruments is not None:
+                instruments.add_time(f'inference/fold_{i + fold_offset}', perf_counter() - fold_start)
+                instruments.count(f'queries/fold_{i + fold_offset}', len(multi_index))
+                instruments.count(f'query_errors/fold_{i + fold_offset}', error_count - fold_errors)
 
     num_queries = sum(len(e) for e in quick_lookup_tables)
-    return quick_lookup_tables, num_queries, type(inferences[0]), error_count
+    method_used = {'compiled': CompiledPosterior,
+                   'markov_blanket': MarkovBlanketPosterior,
+                   'planner': MissingMaskPlanner}.get(method, type(inferences[0]))
+    return quick_lookup_tables, num_queries, method_used, error_count
+
+
+def compiled_answers(compiled, multi_index, environment_variables: list, env_map: dict):
+    """                                 FUNCTION compiled_answers
+       __________________________________________________________________________________________
+         Answers at once every evidence combination of 'multi_index' that 'compiled', a
+         CompiledPosterior or a MarkovBlanketPosterior, can answer exactly; for a
+         CompiledPosterior these are the ones whose Markov blanket variables are all observed
+         (not 'N').  Returns a boolean mask of the answered combinations and the posterior of the
+         target's second state for each of them, i.e. the value fast_query stores for a pgmpy query.
+
+         Combinations containing a state the network has not seen are left unanswered so that
+         the fallback query raises and counts the same error it always has.
+       __________________________________________________________________________________________"""
+    combos = multi_index.to_frame(index=False)
+    combos.columns = environment_variables
+    codes = {}
+    observed = {}
+    for variable in environment_variables:
+        #  The levels of a Categorical column are Categoricals too, and mapping one keeps it Categorical.
+        values = combos[variable].astype(object)
+        observed[variable] = (values != 'N').to_numpy()
+        codes[variable] = values.map(env_map[variable]).fillna(-1).to_numpy(dtype=np.int64)
+    answered, posteriors = compiled.answer(codes, observed)
+    return answered, posteriors[:, 1]
@@ -0,0 +1,125 @@
+"""
+Runs the training and querying of the K folds, optionally in a pool of processes.
+
+The folds are independent, so with n_jobs > 1 every fold's network is built and queried in a
+worker process.  Workers never receive the data through pickling: the data set is encoded once
+as a matrix of integer state codes (see sufficient_stats.encode_columns) and written, with the
+fold id of every row, to .npy files that each worker memory-maps when it starts.  Results come
+back in fold order, so a run is identical to the serial one.
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bayes_net_model import make_kfold_bns, network_structure, bn_from_cpds
+from instrumentation import Instrumentation, timer
+from optimized_query import fast_query, state_mapping
+from query_memo import QueryMemo
+from sufficient_stats import encode_columns, fold_family_counts, fold_ids_from_indexes, training_cpds
+
+#  State shared by the functions below inside a worker process, set once by _init_worker.
+_worker = {}
+
+
+def run_kfold(data_frame: pd.DataFrame, edges: list, test_grp_indexes, environment_variables: list, target: str,
+              n_jobs=1, method='stateless', pseudocount=0, memo=None, instruments=None):
+    """                                 FUNCTION run_kfold
+       __________________________________________________________________________________________
+         Trains one network per testing group and queries it with that group, returning
+         (bayesian_networks, quick_lookup_tables, num_queries, method_used, error_count), i.e.
+         the networks followed by what fast_query returns.
+
+         n_jobs             -   The number of worker processes.  With n_jobs = 1 the folds run
+                                one after another in this process.
+         method             -   The inference method passed to fast_query.
+         pseudocount        -   The Dirichlet smoothing of the CPTs (see make_cpd).
+         memo               -   An optional QueryMemo shared by the folds.  Worker processes
+                                cannot share it, so each worker keeps its own memo for the folds
+                                it runs and only the hit/miss counts are added to 'memo'.
+         instruments        -   An optional Instrumentation (see instrumentation.py).  Workers
+                                record into their own and their records are merged into it.
+       __________________________________________________________________________________________"""
+    if n_jobs <= 1:
+        bns = make_kfold_bns(data_frame, edges, test_grp_indexes, pseudocount=pseudocount, instruments=instruments)
+        return (bns,) + fast_query(bns, test_grp_indexes, environment_variables, data_frame, target,
+                                   method=method, memo=memo, instruments=instruments)
+
+    nodes, parents_of_node = network_structure(edges)
+    codes, states = encode_columns(data_frame, nodes)
+    cardinalities = {node: len(states[node]) for node in nodes}
+    num_folds = len(test_grp_indexes)
+    fold_ids = fold_ids_from_indexes(test_grp_indexes, len(data_frame))
+    family_counts = fold_family_counts(codes, states, nodes, parents_of_node, fold_ids, num_folds, instruments)
+    with timer(instruments, 'cpt_derivation'):
+        fold_cpds = [training_cpds(family_counts, i, pseudocount) for i in range(num_folds)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        codes_path = os.path.join(directory, 'codes.npy')
+        fold_ids_path = os.path.join(directory, 'fold_ids.npy')
+        np.save(codes_path, np.column_stack([codes[variable] for variable in environment_variables]))
+        np.save(fold_ids_path, fold_ids)
+
+        structure = (edges, nodes, parents_of_node, cardinalities)
+        env_states = {variable: states[variable] for variable in environment_variables}
+        with ProcessPoolExecutor(max_workers=min(n_jobs, num_folds),
+                                 initializer=_init_worker,
+                                 initargs=(codes_path, fold_ids_path, structure, env_states,
+                                           environment_variables, target, method, memo is not None,
+                                           instruments is not None)) as executor:
+            results = list(executor.map(_run_fold, range(num_folds), fold_cpds))
+
+    bns = [result[0] for result in results]
+    quick_lookup_tables = [result[1] for result in results]
+    num_queries = sum(len(table) for table in quick_lookup_tables)
+    error_count = sum(result[3] for result in results)
+    if memo is not None:
+        memo.hits += sum(result[4] for result in results)
+        memo.misses += sum(result[5] for result in results)
+    if instruments is not None:
+        for result in results:
+            instruments.merge(result[6])
+    return bns, quick_lookup_tables, num_queries, results[0][2], error_count
+
+
+def _init_worker(codes_path, fold_ids_path, structure, env_states, environment_variables, target, method, use_memo,
+                 use_instruments):
+    _worker['codes'] = np.load(codes_path, mmap_mode='r')
+    _worker['fold_ids'] = np.load(fold_ids_path, mmap_mode='r')
+    _worker['structure'] = structure
+    _worker['states'] = {variable: pd.Index(states) for variable, states in env_states.items()}
+    _worker['env_map'] = {variable: state_mapping(states) for variable, states in env_states.items()}
+    _worker['environment_variables'] = environment_variables
+    _worker['target'] = target
+    _worker['method'] = method
+    _worker['memo'] = QueryMemo() if use_memo else None
+    _worker['use_instruments'] = use_instruments
+
+
+def _run_fold(fold, cpds):
+    #  Builds the network of one fold and queries it with the fold's rows, decoded from the shared codes.
+    edges, nodes, parents_of_node, cardinalities = _worker['structure']
+    bn = bn_from_cpds(edges, nodes, parents_of_node, cardinalities, cpds)
+
+    environment_variables = _worker['environment_variables']
+    rows = np.flatnonzero(_worker['fold_ids'] == fold)
+    fold_codes = _worker['codes'][rows]
+    test_group = pd.DataFrame({variable: _worker['states'][variable].take(fold_codes[:, j])
+                               for j, variable in enumerate(environment_variables)})
+
+    memo = _worker['memo']
+    instruments = Instrumentation() if _worker['use_instruments'] else None
+    hits, misses = (memo.hits, memo.misses) if memo is not None else (0, 0)
+    fq, num_queries, method_used, error_count = fast_query([bn], [np.arange(len(rows))], environment_variables,
+                                                           test_group, _worker['target'],
+                                                           method=_worker['method'],
+                                                           env_map=_worker['env_map'],
+                                                           show_progress=False,
+                                                           memo=memo,
+                                                           instruments=instruments,
+                                                           fold_offset=fold)
+    if memo is not None:
+        hits, misses = memo.hits - hits, memo.misses - misses
+    return bn, fq[0], method_used, error_count, hits, misses, instruments
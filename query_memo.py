@@ -0,0 +1,88 @@
+"""
+A memo of query results shared by the networks of every fold.
+
+Most evidence combinations appear in the testing groups of many folds.  When every variable in
+the target's Markov blanket is observed, the posterior of the target is determined by the
+target's CPT column for the observed parents and by the children's CPT entries for the observed
+children and co-parents.  If those parameters are the same in two folds, so is the posterior, so
+results are memoized on (blanket evidence, digest of those parameters).  When part of the blanket
+is missing the digest covers every CPT of the network instead, which is always safe.
+
+Every key also records the nodes whose CPTs it depends on, so that when some CPTs are re-derived
+(see incremental_model.py) only the entries that depend on them need to be dropped.
+"""
+import hashlib
+
+import numpy as np
+
+
+class QueryMemo:
+    """                                 CLASS QueryMemo
+       __________________________________________________________________________________________
+         Use keyer() once per network to get a NetworkKeyer, then get()/put() with its keys.
+         'hits' and 'misses' count the lookups made through get().
+       __________________________________________________________________________________________"""
+
+    def __init__(self):
+        self.table = {}
+        self.hits = 0
+        self.misses = 0
+
+    def keyer(self, bn, target: str):
+        return NetworkKeyer(bn, target)
+
+    def get(self, key):
+        if key in self.table:
+            self.hits += 1
+            return self.table[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.table[key] = value
+
+    def invalidate(self, nodes):
+        #  Drops every entry that depends on the CPT of one of 'nodes' and returns how many were dropped.
+        nodes = set(nodes)
+        stale = [key for key in self.table if key[3] & nodes]
+        for key in stale:
+            del self.table[key]
+        return len(stale)
+
+
+class NetworkKeyer:
+    #  Computes the memo keys of the queries of one network about 'target'.
+
+    def __init__(self, bn, target: str):
+        cpds = [cpd for cpd in bn.get_cpds() if target in cpd.variables]
+        self.factors = [(cpd.variables, repr(cpd.variables).encode(), cpd.values) for cpd in cpds]
+        self.blanket = sorted({variable for cpd in cpds for variable in cpd.variables} - {target})
+        self.target = target
+        self.cardinality = bn.get_cardinality()
+        self.blanket_nodes = frozenset(cpd.variable for cpd in cpds)
+        self.all_nodes = frozenset(bn.nodes)
+
+        network_digest = hashlib.blake2b(digest_size=16)
+        for cpd in sorted(bn.get_cpds(), key=lambda c: c.variable):
+            network_digest.update(repr(cpd.variables).encode())
+            network_digest.update(np.ascontiguousarray(cpd.values).tobytes())
+        self.network_digest = network_digest.digest()
+
+    def key(self, query_evidence: dict):
+        """
+        Returns the memo key of a query given its evidence (variable -> state index), or None
+        if the evidence contains a state the network does not have (such queries are not memoized).
+        """
+        if any(state >= self.cardinality[variable] for variable, state in query_evidence.items()):
+            return None
+        if any(variable not in query_evidence for variable in self.blanket):
+            return self.target, tuple(sorted(query_evidence.items())), self.network_digest, self.all_nodes
+
+        digest = hashlib.blake2b(digest_size=16)
+        for variables, name, values in self.factors:
+            digest.update(name)
+            index = tuple(slice(None) if variable == self.target else query_evidence[variable]
+                          for variable in variables)
+            digest.update(np.ascontiguousarray(values[index]).tobytes())
+        return (self.target, tuple((variable, query_evidence[variable]) for variable in self.blanket), digest.digest(),
+                self.blanket_nodes)
@@ -0,0 +1,140 @@
+"""
+A persistent, content-addressed cache of trained networks and fast_query lookup tables.
+
+Reruns on the same data file with the same network and folds only differ in post-processing
+(risk cutoffs, report formatting), so the CPTs and query results of a run are saved under a key
+computed from the data file's contents, the edge list, the random seed, K and any other setting
+that changes the training data.  Every entry is a single uncompressed .npz file holding the CPT
+arrays, the lookup tables as integer state codes plus posteriors, and a JSON header with the
+state names.  Entries are evicted least recently used first once the cache exceeds its size.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from compact_model import CompactModel, json_value
+
+DEFAULT_DIRECTORY = 'kfold_cache'
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def file_digest(path, chunk_size=1 << 20):
+    #  sha256 of the contents of the file at 'path', read in chunks.
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """                                 CLASS ResultCache
+       __________________________________________________________________________________________
+         directory          -   Where the .npz entries are stored.  Created if needed.
+         max_bytes          -   The total size above which the least recently used entries are
+                                deleted.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(data_path, edges: list, seed, k, **settings):
+        """
+        Returns the key of a run.  'settings' should hold every other parameter that changes the
+        networks or the query results (e.g. DROP_CUTOFF, NUM_ROWS, the inference method).
+        """
+        description = json.dumps({'data': file_digest(data_path),
+                                   'edges': [list(edge) for edge in edges],
+                                   'seed': seed,
+                                   'k': k,
+                                   'settings': {name: json_value(value) for name, value in settings.items()}},
+                                  sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key, compact=False):
+        """
+        Returns (bayesian_networks, quick_lookup_tables, num_queries, method_used, error_count), as
+        returned by run_kfold, or None if the key is not cached.  With 'compact' the networks are
+        CompactModels (see compact_model.py), which does not import pgmpy.
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        with np.load(path) as entry:
+            header = json.loads(str(entry['header']))
+            edges = [tuple(edge) for edge in header['edges']]
+            nodes = header['nodes']
+            parents_of_node = header['parents_of_node']
+            cardinalities = header['cardinalities']
+
+            fold_cpds = [[entry[f'cpd_{fold}_{i}'] for i in range(len(nodes))] for fold in range(header['num_folds'])]
+            if compact:
+                bns = [CompactModel.from_cpds(nodes, parents_of_node, cardinalities, cpds) for cpds in fold_cpds]
+            else:
+                #  pgmpy is only imported when the networks are asked for.
+                from bayes_net_model import bn_from_cpds
+                bns = [bn_from_cpds(edges, nodes, parents_of_node, cardinalities, cpds) for cpds in fold_cpds]
+
+            quick_lookup_tables = []
+            for fold, level_states in enumerate(header['lookup_states']):
+                codes = entry[f'lookup_codes_{fold}']
+                levels = [pd.Index(states).take(codes[:, j]) for j, states in enumerate(level_states)]
+                index = pd.MultiIndex.from_arrays(levels, names=header['environment_variables'])
+                quick_lookup_tables.append(pd.DataFrame({'0_y': entry[f'lookup_values_{fold}']}, index=index))
+        return bns, quick_lookup_tables, header['num_queries'], header['method_used'], header['error_count']
+
+    def store(self, key, bns: list, quick_lookup_tables: list, num_queries, method_used, error_count):
+        nodes = list(bns[0].nodes)
+        cpds = {node: bns[0].get_cpds(node) for node in nodes}
+        header = {'edges': [list(edge) for edge in bns[0].edges],
+                  'nodes': nodes,
+                  'parents_of_node': [cpds[node].variables[1:] for node in nodes],
+                  'cardinalities': {node: int(cpds[node].variable_card) for node in nodes},
+                  'environment_variables': list(quick_lookup_tables[0].index.names),
+                  'num_folds': len(bns),
+                  'num_queries': int(num_queries),
+                  'method_used': str(method_used),
+                  'error_count': int(error_count),
+                  'lookup_states': []}
+
+        arrays = {}
+        for fold, bn in enumerate(bns):
+            for i, node in enumerate(nodes):
+                arrays[f'cpd_{fold}_{i}'] = bn.get_cpds(node).get_values()
+        for fold, quick_lookup in enumerate(quick_lookup_tables):
+            level_codes = []
+            level_states = []
+            for j in range(quick_lookup.index.nlevels):
+                codes, states = pd.factorize(quick_lookup.index.get_level_values(j), sort=True)
+                level_codes.append(codes)
+                level_states.append([json_value(state) for state in states])
+            header['lookup_states'].append(level_states)
+            arrays[f'lookup_codes_{fold}'] = np.column_stack(level_codes).astype(np.int32)
+            #  Failed queries hold their evidence tuple instead of a probability, they are stored as NaN.
+            arrays[f'lookup_values_{fold}'] = pd.to_numeric(quick_lookup['0_y'], errors='coerce').to_numpy(dtype=float)
+
+        path = self._path(key)
+        np.savez(path + '.tmp.npz', header=np.array(json.dumps(header)), **arrays)
+        os.replace(path + '.tmp.npz', path)
+        self._evict(keep=path)
+
+    def _evict(self, keep):
+        #  Deletes the least recently used entries, other than 'keep', until the cache fits in max_bytes.
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                   if name.endswith('.npz') and os.path.join(self.directory, name) != keep]
+        entries.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in entries) + os.path.getsize(keep)
+        while entries and total > self.max_bytes:
+            path = entries.pop(0)
+            total -= os.path.getsize(path)
+            os.remove(path)
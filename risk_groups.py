@@ -5,79 +5,112 @@ Written      :    June 22, 2022
 Last Update  :    June 22, 2022
 """
 
-import pandas as pd
+import os
 import random
 from datetime import datetime
 from time import time
 
-from bayes_net_model import make_bn
-from optimized_query import fast_query
+from compact_model import CompactModel
+from data_loader import load_compact, load_rows
+from general_kfold import network_description
 from get_client_spreadsheet import return_client_csv
+from result_cache import ResultCache, DEFAULT_DIRECTORY
+from scoring import score_test_group, risk_group, PREDICTION_CUTOFF, MODERATE_RISK_CUTOFF
 
-# we will define variables begin and end to keep track of program execution time
-begin = time()
-
-random.seed(100)
+SEED = 100
 DROP_CUTOFF = 20
-df = pd.read_csv('ACST_Cust_Data.csv')
-NUM_ROWS = len(df)
+DATA_PATH = 'ACST_Cust_Data.csv'
 TARGET_VARIABLE = 'Satisfied'
-index = list(range(len(df)))
+OUTPUT_DIRECTORY = 'risk_spreadsheets/'
+#  With QUERY_JOBS > 1 the single network's queries are answered by a pool of this many processes (see QueryExecutor).
+QUERY_JOBS = 1
+#  The trained network is also saved here as a CompactModel, e.g. for python scoring_service.py --model risk_model.cmdl
+MODEL_PATH = 'risk_model.cmdl'
 
-'''  AS CURRENTLY IMPLEMENTED, THIS PROGRAM WILL FAIL FOR LESS THAN 3 NODE BNs!!!!  
+'''  AS CURRENTLY IMPLEMENTED, THIS PROGRAM WILL FAIL FOR LESS THAN 3 NODE BNs!!!!
 '''
-bayesian_network = make_bn(df, [])
-environment_variables = [variable for variable in bayesian_network]
-environment_variables.remove(TARGET_VARIABLE)
+EDGES = []
 
-''' 
-The function fast_query will query all of the bayesian networks with the whole environment
-map and map the queries to their respective outputs, reducing computation time by 
-eliminating repeat calculations.
-'''
 
-fq, num_queries, method_used, external_errors = fast_query([bayesian_network],
-                                                           index,
-                                                           environment_variables,
-                                                           df,
-                                                           TARGET_VARIABLE)
+def risk_groups(data_path=DATA_PATH, edges=EDGES, target=TARGET_VARIABLE, seed=SEED, drop_cutoff=DROP_CUTOFF,
+                query_jobs=QUERY_JOBS, prediction_cutoff=PREDICTION_CUTOFF, moderate_risk_cutoff=MODERATE_RISK_CUTOFF,
+                output_directory=OUTPUT_DIRECTORY, model_path=MODEL_PATH, cache_directory=DEFAULT_DIRECTORY):
+    """                                 FUNCTION risk_groups
+       __________________________________________________________________________________________
+         Trains one network on every row of the file at 'data_path', scores every row with it,
+         writes the risk spreadsheets and the report to a new folder of 'output_directory' and
+         saves the network as a CompactModel at 'model_path' (None skips it).  Returns a dict
+         holding the report, the 'scores' frame and the folder's name.  See cli.py for the
+         command line.
+
+         pgmpy is only imported when the network has to be trained, a cached run never imports it.
+       __________________________________________________________________________________________"""
+    # we will define variables begin and end to keep track of program execution time
+    begin = time()
+    random.seed(seed)
+
+    #  Only the ID and the network's variables are read, each encoded once as a sorted Categorical (see data_loader.py).
+    #  The other columns are only read for the clients in the risk groups, when their spreadsheets are written.
+    df, states = load_compact(data_path, list(dict.fromkeys(node for edge in edges for node in edge)))
+    index = list(range(len(df)))
+
+    '''
+    The function fast_query will query all of the bayesian networks with the whole environment
+    map and map the queries to their respective outputs, reducing computation time by
+    eliminating repeat calculations.  There is only one network, so its queries are split among
+    query_jobs processes instead.  The network and its lookup table are cached on disk (see
+    result_cache.py), so reruns that only change the risk cutoffs skip both steps.
+    '''
+    cache = ResultCache(cache_directory)
+    cache_key = ResultCache.make_key(data_path, edges, seed, 1, target=target)
+    cached_run = cache.load(cache_key, compact=True)
+    if cached_run is None:
+        #  Training and querying import pgmpy, which is why they are imported here.
+        from bayes_net_model import make_bn
+        from optimized_query import fast_query
+        bayesian_network = make_bn(df, edges)
+        environment_variables = [variable for variable in bayesian_network.nodes if variable != target]
+        fq, num_queries, method_used, external_errors = fast_query([bayesian_network],
+                                                                   [index],
+                                                                   environment_variables,
+                                                                   df,
+                                                                   target,
+                                                                   n_jobs=query_jobs,
+                                                                   pool='process')
+        cache.store(cache_key, [bayesian_network], fq, num_queries, method_used, external_errors)
+        model = CompactModel.from_network(bayesian_network, states)
+    else:
+        bayesian_networks, fq, num_queries, method_used, external_errors = cached_run
+        bayesian_network = bayesian_networks[0]
+        environment_variables = [variable for variable in bayesian_network.nodes if variable != target]
+        model = bayesian_network.with_states(states)
+    if model_path is not None:
+        model.save(model_path)
+
+    scores = score_test_group(df, fq[0], environment_variables, target, prediction_cutoff, moderate_risk_cutoff)
+    high_risk_group = risk_group(scores, 'high_risk')
+    moderate_risk_group = risk_group(scores, 'moderate_risk')
 
-high_risk_group = []
-moderate_risk_group = []
-for i in range(len(df)):
-    #  'state_instantiation' is a Series from which we can obtain the instantiated state variables.
-    state_instantiation = df.iloc[i][environment_variables]
+    """                             REPORT PRINTING                             """
+    date_stamp = datetime.now()
+    end = time()
+    client_rows = load_rows(data_path, [client for client, _ in high_risk_group + moderate_risk_group])
+    file_name = return_client_csv(high_risk_lst=high_risk_group,
+                                  moderate_risk_lst=moderate_risk_group,
+                                  data_frame=client_rows,
+                                  parent_directory=output_directory)
+    report = f'###################################################      {file_name}      {date_stamp}      >{drop_cutoff} MissingValues dropped!!!   ##################################################\n\n' \
+             f'Method Used : {method_used}\n' \
+             f'Execution Time : {round(((end - begin) / 60), 2)} minutes\n' \
+             f'The network was queried {num_queries} times.  FastQuery saved {len(df) - num_queries} redundant queries.\n' \
+             f'{network_description(bayesian_network)}'
+    print(report)
+    with open('risk_groups.txt', 'a+') as file:
+        file.write('\n\n' + report)
+    with open(os.path.join(output_directory, file_name, f'{file_name}.txt'), 'w+') as file:
+        file.write(report)
+    return {'file_name': file_name, 'report': report, 'scores': scores}
 
-    #  'prediction' is the max likelihood state of the target variable given the states of the other variables.
-    client_ID = df.iloc[i]['ID']
-    prediction = fq[0].loc[tuple(state_instantiation.values)]['0_y']
-    #  'actual_target_value' is the true value of the state variable we are trying to predict.
-    actual_target_value = df.iloc[i][TARGET_VARIABLE]
-    try:
-        if (prediction < .60) and (prediction > .5) and actual_target_value:
-            moderate_risk_group.append((client_ID, prediction))
-        elif not (round(prediction)) and actual_target_value:
-            # client_ID - ID in data set of client about whom we are making a prediction.
-            high_risk_group.append((client_ID, prediction))
-    except (ValueError, TypeError) as e:
-        print(e)
 
-"""                             REPORT PRINTING                             """
-date_stamp = datetime.now()
-end = time()
-file_name = return_client_csv(high_risk_lst=high_risk_group,
-                              moderate_risk_lst=moderate_risk_group,
-                              data_frame=df)
-report = f'###################################################      {file_name}      {date_stamp}      >{DROP_CUTOFF} MissingValues dropped!!!   ##################################################\n\n' \
-         f'Method Used : {method_used}\n' \
-         f'Execution Time : {round(((end - begin) / 60), 2)} minutes\n' \
-         f'The network was queried {num_queries} times.  FastQuery saved {len(df) - num_queries} redundant queries.\n' \
-         f'Nodes : {bayesian_network.nodes}\n' \
-         f'Edges : {bayesian_network.edges}\n' \
-         f'In Degree : {bayesian_network.in_degree}\n' \
-         f'Out Degree : {bayesian_network.out_degree}\n'
-print(report)
-with open('risk_groups.txt', 'a+') as file:
-    file.write('\n\n' + report)
-with open(f'risk_spreadsheets/{file_name}/{file_name}.txt', 'w+') as file:
-    file.write(report)
+if __name__ == '__main__':
+    risk_groups()
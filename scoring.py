@@ -0,0 +1,72 @@
+"""
+Vectorized scoring of testing groups against the lookup tables returned by fast_query.
+"""
+import numpy as np
+import pandas as pd
+
+#  The probability of the target above which we predict 'satisfied', and the upper end of the moderate risk tier.
+PREDICTION_CUTOFF = .5
+MODERATE_RISK_CUTOFF = .60
+
+
+def score_test_group(test_group: pd.DataFrame, quick_lookup: pd.DataFrame, environment_variables: list, target: str,
+                     prediction_cutoff=PREDICTION_CUTOFF, moderate_risk_cutoff=MODERATE_RISK_CUTOFF):
+    """                                 FUNCTION score_test_group
+       __________________________________________________________________________________________
+         Joins every row of 'test_group' to its entry in 'quick_lookup' (one of the tables
+         returned by fast_query) with a single merge and returns a DataFrame with one row per
+         test row, in the same order, and the columns
+
+            ID              -   The client ID.
+            prediction      -   The probability that the target is true given the row's environment.
+            actual          -   The true value of the target.
+            error           -   True where the query failed and no probability is available.
+            correct         -   True where (prediction > prediction_cutoff) == actual.
+            moderate_risk   -   Satisfied clients with prediction_cutoff < prediction < moderate_risk_cutoff.
+            high_risk       -   Satisfied clients predicted to be unsatisfied (the false negatives).
+
+         Rows with errors are never correct nor at risk.
+       __________________________________________________________________________________________"""
+    lookup = quick_lookup.reset_index()[environment_variables + ['0_y']]
+    merged = pd.merge(test_group[['ID', target] + environment_variables], lookup,
+                      how='left', on=environment_variables, validate='many_to_one')
+
+    #  A failed query leaves its evidence tuple in the lookup table instead of a probability.
+    prediction = pd.to_numeric(merged['0_y'], errors='coerce').to_numpy(dtype=float)
+    actual = merged[target].to_numpy().astype(bool)
+    return pd.DataFrame({'ID': merged['ID'].to_numpy(),
+                         'prediction': prediction,
+                         'actual': actual,
+                         **_outcomes(prediction, actual, prediction_cutoff, moderate_risk_cutoff)})
+
+
+def score_test_groups(test_groups: list, quick_lookup_tables: list, environment_variables: list, target: str,
+                      prediction_cutoff=PREDICTION_CUTOFF, moderate_risk_cutoff=MODERATE_RISK_CUTOFF):
+    #  Scores every testing group and stacks the results, adding a 'fold' column.
+    scores = [score_test_group(test_group, quick_lookup, environment_variables, target,
+                               prediction_cutoff, moderate_risk_cutoff)
+              for test_group, quick_lookup in zip(test_groups, quick_lookup_tables)]
+    return pd.concat(scores, keys=range(len(scores)), names=['fold', None]).reset_index(level=0)
+
+
+def rescore(scores: pd.DataFrame, prediction_cutoff=PREDICTION_CUTOFF, moderate_risk_cutoff=MODERATE_RISK_CUTOFF):
+    #  'scores' with its error, correct and risk columns recomputed for other cutoffs, without querying anything again.
+    prediction = scores['prediction'].to_numpy(dtype=float)
+    outcomes = _outcomes(prediction, scores['actual'].to_numpy(dtype=bool), prediction_cutoff, moderate_risk_cutoff)
+    return scores.assign(**outcomes)
+
+
+def _outcomes(prediction, actual, prediction_cutoff, moderate_risk_cutoff):
+    #  The error, correct, moderate_risk and high_risk columns described in score_test_group.
+    error = np.isnan(prediction)
+    predicted = prediction > prediction_cutoff
+    return {'error': error,
+            'correct': ~error & (predicted == actual),
+            'moderate_risk': predicted & (prediction < moderate_risk_cutoff) & actual,
+            'high_risk': ~error & ~predicted & actual}
+
+
+def risk_group(scores: pd.DataFrame, column: str):
+    #  Returns the (ID, prediction) pairs of the clients flagged in 'column', the format return_client_csv expects.
+    flagged = scores.loc[scores[column]]
+    return list(zip(flagged['ID'], flagged['prediction']))
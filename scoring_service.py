@@ -0,0 +1,333 @@
+"""
+A long-lived scorer of customer rows, with a JSON lines (stdin/stdout) and a local HTTP endpoint.
+
+risk_groups.py rebuilds the network and queries every row each time it runs.  RiskScorer instead
+loads a trained network once, compiles the posterior table of the target (see compiled_inference.py)
+and keeps a query engine and a QueryMemo warm, so a batch of rows is answered with one gather for
+the rows whose Markov blanket is observed and one memoized query per distinct evidence for the rest.
+
+Both endpoints speak the same protocol, implemented by 'handle':
+
+    {"rows": [{"ID": 17, "Product": "A", ...}, ...]}   ->   {"results": [{"ID": 17, "prediction": 0.71,
+                                                                          "tier": "low"}, ...]}
+    {"command": "stats"}                               ->   the counters returned by RiskScorer.stats
+
+    python scoring_service.py --data ACST_Cust_Data.csv --edges edges.json             (stdin/stdout)
+    python scoring_service.py --data ACST_Cust_Data.csv --edges edges.json --port 8000  (POST /score, GET /stats)
+    python scoring_service.py --model risk_model.cmdl                                   (a saved CompactModel)
+
+A CompactModel (see compact_model.py) is served with a MissingMaskPlanner built from its arrays, so
+pgmpy is only imported if a row needs a query the planner cannot answer.
+"""
+import argparse
+import collections
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from compact_model import CompactModel
+from compiled_inference import CompiledPosterior
+from query_memo import QueryMemo
+from scoring import PREDICTION_CUTOFF, MODERATE_RISK_CUTOFF
+
+#  The number of most recent batches the latency percentiles are computed over.
+LATENCY_WINDOW = 10_000
+
+
+class RiskScorer:
+    """                                 CLASS RiskScorer
+       __________________________________________________________________________________________
+         bn                 -   A trained BayesianNetwork, e.g. from make_bn or CountModel, or a
+                                CompactModel.
+         target             -   The name of the target variable.
+         states             -   Maps every environment variable to the sorted list of its states
+                                (as returned by load_compact or make_bns_from_file).  May be None
+                                for a CompactModel saved with its states.
+
+         Every scored row gets the probability that the target is true and a risk tier: 'high'
+         if the prediction is at most prediction_cutoff (the client is predicted to be
+         unsatisfied), 'moderate' if it is below moderate_risk_cutoff, 'low' otherwise, and
+         'error' if the row holds a state the network has never seen.  Rows are the rows of the
+         data file; 'N' marks a missing value.  score() may be called from several threads.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, bn, target: str, states: dict = None, prediction_cutoff=PREDICTION_CUTOFF,
+                 moderate_risk_cutoff=MODERATE_RISK_CUTOFF):
+        self.target = target
+        self.prediction_cutoff = prediction_cutoff
+        self.moderate_risk_cutoff = moderate_risk_cutoff
+        self._lock = threading.Lock()
+        self.load(bn, states)
+
+        self.requests = 0
+        self.rows = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.started = perf_counter()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    @classmethod
+    def from_file(cls, path, edges: list, target: str, row_filter=None, pseudocount=0, **cutoffs):
+        #  Trains the network on every row of the .csv or .parquet file at 'path' without loading it whole.
+        from bayes_net_model import make_bns_from_file
+        bns, states = make_bns_from_file(path, edges, row_filter=row_filter, pseudocount=pseudocount)
+        return cls(bns[0], target, states, **cutoffs)
+
+    @classmethod
+    def from_model(cls, model, target: str, **cutoffs):
+        #  Serves the network of an incremental_model.CountModel.  Call load(model.bn, model.states) after updates.
+        return cls(model.bn, target, model.states, **cutoffs)
+
+    @classmethod
+    def from_compact(cls, path, target: str, **cutoffs):
+        #  Serves the CompactModel saved at 'path', memory-mapped.
+        return cls(CompactModel.load(path), target, **cutoffs)
+
+    def load(self, bn, states: dict = None):
+        #  Swaps in a new network, e.g. after the nightly refresh, keeping the counters.
+        environment_variables = [variable for variable in bn.nodes if variable != self.target]
+        if states is None:
+            #  A pgmpy network's state names are the indexes of its count tensors, not the states of the data.
+            if not isinstance(bn, CompactModel) or bn.states is None:
+                raise ValueError('states are required unless bn is a CompactModel saved with its states')
+            states = bn.states
+        compiled = None
+        planner = None
+        inference = None
+        if isinstance(bn, CompactModel):
+            #  The query engine is only built, from bn.to_network(), if the planner leaves a row unanswered.
+            planner = bn.planner(self.target)
+        else:
+            try:
+                compiled = CompiledPosterior(bn, self.target)
+            except ValueError as e:
+                print(f'{e}, every row will be queried.', file=sys.stderr)
+            inference = _query_engine(bn)
+        memo = QueryMemo()
+        with self._lock:
+            self.bn = bn
+            self.environment_variables = environment_variables
+            #  The states are indexed in sorted order, as by state_mapping.
+            self.env_map = {variable: {state: i for i, state in enumerate(sorted(states[variable]))}
+                            for variable in environment_variables}
+            self.compiled = compiled
+            self.planner = planner
+            self.inference = inference
+            self.memo = memo
+            self.keyer = memo.keyer(bn, self.target) if inference is not None else None
+
+    def score(self, rows):
+        """
+        'rows' is a DataFrame or a list of dicts holding every environment variable (and optionally
+        'ID').  Returns a DataFrame with the columns ID (if given), prediction and tier, in row order.
+        """
+        begin = perf_counter()
+        rows = pd.DataFrame(rows) if not isinstance(rows, pd.DataFrame) else rows
+        with self._lock:
+            prediction = self._predict(rows)
+        tier = np.select([np.isnan(prediction), prediction <= self.prediction_cutoff,
+                          prediction < self.moderate_risk_cutoff],
+                         ['error', 'high', 'moderate'], default='low')
+        scores = pd.DataFrame({'prediction': prediction, 'tier': tier})
+        if 'ID' in rows:
+            scores.insert(0, 'ID', rows['ID'].to_numpy())
+
+        elapsed = perf_counter() - begin
+        with self._lock:
+            self.requests += 1
+            self.rows += len(rows)
+            self.errors += int(np.isnan(prediction).sum())
+            self.busy_seconds += elapsed
+            self.latencies.append(elapsed)
+        return scores
+
+    def _predict(self, rows: pd.DataFrame):
+        #  The posterior of the target's second state for every row, NaN where a state is unknown.
+        num_rows = len(rows)
+        codes = {}
+        observed = {}
+        known = np.ones(num_rows, dtype=bool)
+        for variable in self.environment_variables:
+            values = rows[variable].astype(object)
+            observed[variable] = (values.astype(str) != 'N').to_numpy()
+            mapped = values.map(self.env_map[variable])
+            if mapped.isna().any():
+                #  Values parsed from JSON may be strings where the states are numbers, or the reverse.
+                by_name = {str(state): code for state, code in self.env_map[variable].items()}
+                mapped = mapped.fillna(values.astype(str).map(by_name))
+            known &= ~observed[variable] | mapped.notna().to_numpy()
+            codes[variable] = mapped.fillna(-1).to_numpy(dtype=np.int64)
+
+        prediction = np.full(num_rows, np.nan)
+        pending = known.copy()
+        if self.compiled is not None:
+            gathered = known.copy()
+            for variable in self.compiled.variables:
+                gathered &= observed[variable]
+            posteriors = self.compiled.lookup({variable: codes[variable][gathered]
+                                               for variable in self.compiled.variables})
+            prediction[gathered] = posteriors[:, 1]
+            pending &= ~gathered
+        if self.planner is not None:
+            answered, posteriors = self.planner.answer(codes, observed)
+            #  Rows holding an unknown state are not in range, so they are never answered.
+            prediction[answered] = posteriors[:, 1]
+            pending &= ~answered
+
+        #  One query per distinct evidence among the remaining rows, memoized across batches.
+        pending = np.flatnonzero(pending)
+        if len(pending):
+            evidence_codes = np.column_stack([np.where(observed[variable][pending], codes[variable][pending], -1)
+                                              for variable in self.environment_variables])
+            distinct, inverse = np.unique(evidence_codes, axis=0, return_inverse=True)
+            answers = np.empty(len(distinct))
+            for j, combination in enumerate(distinct):
+                evidence = {variable: int(code) for variable, code in zip(self.environment_variables, combination)
+                            if code >= 0}
+                if self.inference is None:
+                    network = self.bn.to_network()
+                    self.inference = _query_engine(network)
+                    self.keyer = self.memo.keyer(network, self.target)
+                key = self.keyer.key(evidence)
+                posterior = self.memo.get(key) if key is not None else None
+                if posterior is None:
+                    posterior = self.inference.query([self.target], evidence).values[1]
+                    if key is not None:
+                        self.memo.put(key, posterior)
+                answers[j] = posterior
+            prediction[pending] = answers[inverse.reshape(-1)]
+        return prediction
+
+    def stats(self):
+        #  Throughput and latency counters since the scorer was created.
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            busy_seconds = self.busy_seconds
+            counters = {'requests': self.requests,
+                        'rows': self.rows,
+                        'errors': self.errors,
+                        'memo_hits': self.memo.hits,
+                        'memo_misses': self.memo.misses}
+        counters['uptime_seconds'] = perf_counter() - self.started
+        counters['rows_per_second'] = counters['rows'] / busy_seconds if busy_seconds else 0.0
+        for percentile in (50, 95, 99):
+            counters[f'latency_ms_p{percentile}'] = float(np.percentile(latencies, percentile)) if len(latencies) else 0.0
+        return counters
+
+
+def _query_engine(bn):
+    #  pgmpy is imported here rather than at the top, a CompactModel may never need it.
+    from optimized_query import StatelessVariableElimination
+    return StatelessVariableElimination(bn)
+
+
+def handle(scorer: RiskScorer, request: dict):
+    #  Answers one request of the protocol described at the top of this module.
+    if request.get('command') == 'stats':
+        return scorer.stats()
+    if 'rows' not in request:
+        return {'error': "expected {'rows': [...]} or {'command': 'stats'}"}
+    try:
+        scores = scorer.score(request['rows'])
+    except KeyError as e:
+        return {'error': f'missing column {e}'}
+    except Exception as e:
+        #  A bad batch is answered with its error, it must not stop serve_lines or the HTTP server.
+        return {'error': f'{type(e).__name__} : {e}'}
+    return {'results': json.loads(scores.to_json(orient='records'))}
+
+
+class LocalClient:
+    #  A stand-in for a remote client: requests and responses go through JSON exactly as they do over the endpoints.
+
+    def __init__(self, scorer: RiskScorer):
+        self.scorer = scorer
+
+    def _send(self, request: dict):
+        return json.loads(json.dumps(handle(self.scorer, json.loads(json.dumps(request, default=str)))))
+
+    def score(self, rows: list):
+        return self._send({'rows': rows})
+
+    def stats(self):
+        return self._send({'command': 'stats'})
+
+
+def serve_lines(scorer: RiskScorer, input_stream=sys.stdin, output_stream=sys.stdout):
+    #  Answers one JSON request per line of 'input_stream' with one JSON line on 'output_stream', until EOF.
+    for line in input_stream:
+        if not line.strip():
+            continue
+        try:
+            response = handle(scorer, json.loads(line))
+        except json.JSONDecodeError as e:
+            response = {'error': f'invalid JSON : {e}'}
+        output_stream.write(json.dumps(response) + '\n')
+        output_stream.flush()
+
+
+def make_server(scorer: RiskScorer, host='127.0.0.1', port=8000):
+    #  An HTTPServer answering POST /score and GET /stats; port 0 picks a free port (see server.server_port).
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, response):
+            body = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, handle(scorer, {'command': 'stats'}))
+            else:
+                self._reply(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._reply(404, {'error': f'unknown path {self.path}'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except json.JSONDecodeError as e:
+                self._reply(400, {'error': f'invalid JSON : {e}'})
+                return
+            response = handle(scorer, request)
+            self._reply(400 if 'error' in response else 200, response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return HTTPServer((host, port), Handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scores batches of customer rows with a warm network.')
+    parser.add_argument('--data', default='ACST_Cust_Data.csv', help='the .csv or .parquet file to train on')
+    parser.add_argument('--edges', help='a JSON file holding the list of [parent, child] edges')
+    parser.add_argument('--model', help='serve this saved CompactModel instead of training on --data')
+    parser.add_argument('--target', default='Satisfied')
+    parser.add_argument('--port', type=int, help='serve HTTP on this port instead of stdin/stdout')
+    arguments = parser.parse_args()
+
+    if arguments.model is not None:
+        risk_scorer = RiskScorer.from_compact(arguments.model, arguments.target)
+    elif arguments.edges is not None:
+        with open(arguments.edges) as file:
+            edges = [tuple(edge) for edge in json.load(file)]
+        risk_scorer = RiskScorer.from_file(arguments.data, edges, arguments.target)
+    else:
+        parser.error('either --model or --edges is required')
+    if arguments.port is None:
+        serve_lines(risk_scorer)
+    else:
+        server = make_server(risk_scorer, port=arguments.port)
+        print(f'Serving on http://127.0.0.1:{server.server_port}', file=sys.stderr)
+        server.serve_forever()
@@ -0,0 +1,66 @@
+"""
+K-fold splitting by index.
+
+A split is represented by a vector of fold ids: entry j is the testing group (0, ..., K-1) of row j,
+or -1 if row j is not part of the sample.  Index arrays for each fold are only produced when asked
+for, so no DataFrame is copied and the memory used is O(N) whatever K is.  The fold ids can be
+passed straight to the count-based training (bayes_net_model.make_bns_from_fold_ids).
+"""
+import random
+
+import numpy as np
+
+
+def kfold_ids(num_rows, k, seed=None, num_samples=None, stratify=None):
+    """                                 FUNCTION kfold_ids
+       __________________________________________________________________________________________
+         Returns the fold id vector of a random K-fold split of 'num_samples' of the 'num_rows'
+         rows (all of them by default).
+
+         Without 'stratify' this is the split general_kfold.py has always used: the rows are
+         shuffled with random.sample, the first K * (num_samples // K) are cut into K equal groups
+         and the n = num_samples % K remaining rows are added to the first n groups.
+
+         stratify           -   Optional array of the class of every row (e.g. the values of
+                                TARGET_VARIABLE).  The rows of each class are then shuffled and
+                                dealt to the folds in turn, so every fold has the same class
+                                proportions, up to one row per class.
+       __________________________________________________________________________________________"""
+    rng = random.Random(seed)
+    num_samples = num_rows if num_samples is None else num_samples
+    sample = np.array(rng.sample(range(num_rows), num_samples), dtype=np.int64)
+    fold_ids = np.full(num_rows, -1, dtype=np.int64)
+
+    if stratify is None:
+        n = num_samples % k
+        fold_ids[sample[:num_samples - n]] = np.repeat(np.arange(k), num_samples // k)
+        fold_ids[sample[num_samples - n:]] = np.arange(n)
+        return fold_ids
+
+    classes = np.asarray(stratify)[sample]
+    offset = 0
+    for label in sorted(set(classes.tolist())):
+        members = sample[classes == label]
+        fold_ids[members] = (offset + np.arange(len(members))) % k
+        offset += len(members)
+    return fold_ids
+
+
+def repeated_kfold_ids(num_rows, k, repeats, seed=0, num_samples=None, stratify=None):
+    #  Yields the fold id vectors of 'repeats' independent K-fold splits, the rth using seed + r.
+    for repeat in range(repeats):
+        yield kfold_ids(num_rows, k, seed=seed + repeat, num_samples=num_samples, stratify=stratify)
+
+
+def test_indexes(fold_ids, k):
+    #  The list of the row indexes of each testing group, the 'test_grp_indexes' fast_query expects.
+    order = np.argsort(fold_ids, kind='stable')
+    boundaries = np.searchsorted(fold_ids[order], np.arange(k + 1))
+    return [order[boundaries[i]:boundaries[i + 1]] for i in range(k)]
+
+
+def split(fold_ids, k):
+    #  Lazily yields (train_index, test_index) for each fold.
+    in_sample = fold_ids >= 0
+    for i in range(k):
+        yield np.flatnonzero(in_sample & (fold_ids != i)), np.flatnonzero(fold_ids == i)
@@ -0,0 +1,262 @@
+"""
+Score-based structure learning: hill climbing (optionally with a tabu list) over DAGs.
+
+The BIC and BDeu scores both decompose into one term per family (a node and its parents), so a
+move only changes the score of the families it touches: adding or removing u -> v changes the
+family of v, reversing it changes the families of u and v.  Family scores are computed from the
+family's count table (cpdmaker.count_configurations) and cached by (node, parents), so a family is
+counted once however many times the search visits it.  The families a step needs that are not
+cached yet are scored in a pool of processes when n_jobs > 1.
+
+The result is an edge list in the format make_bn, make_kfold_bns and run_kfold take.
+
+usage : python structure_search.py data.csv Satisfied Var1 Var2 Product ... [--score bdeu] [--output edges.json]
+"""
+import argparse
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.special import gammaln
+
+from cpdmaker import count_configurations
+from sufficient_stats import encode_columns
+
+#  State shared by the functions below inside a worker process, set once by _init_worker.
+_worker = {}
+
+
+def family_score(counts, score='bic', equivalent_sample_size=10):
+    """                                 FUNCTION family_score
+       __________________________________________________________________________________________
+         The score of one family from its count table, of shape (card_node, card_parent_1, ...)
+         as returned by count_configurations.
+
+         score              -   'bic' : the log likelihood minus (log N / 2) times the number of
+                                free parameters, (card_node - 1) * (number of parent
+                                configurations).
+                                'bdeu' : the log marginal likelihood under a uniform Dirichlet
+                                prior of total weight 'equivalent_sample_size'.
+       __________________________________________________________________________________________"""
+    cardinality = counts.shape[0]
+    counts = counts.reshape(cardinality, -1).astype(float)
+    num_configurations = counts.shape[1]
+    column_totals = counts.sum(axis=0)
+    if score == 'bic':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_likelihood = np.nansum(counts * np.log(counts / column_totals))
+        num_rows = column_totals.sum()
+        return log_likelihood - .5 * math.log(num_rows) * (cardinality - 1) * num_configurations
+    if score == 'bdeu':
+        alpha = equivalent_sample_size / num_configurations
+        beta = alpha / cardinality
+        return (np.sum(gammaln(alpha) - gammaln(alpha + column_totals))
+                + np.sum(gammaln(beta + counts) - gammaln(beta)))
+    raise ValueError(f"Unknown score '{score}', expected 'bic' or 'bdeu'")
+
+
+class FamilyScores:
+    """                                 CLASS FamilyScores
+       __________________________________________________________________________________________
+         The cache of family scores.  get(node, parents) counts and scores the family the first
+         time it is asked for, prefetch() scores many families at once, in parallel if n_jobs > 1.
+       __________________________________________________________________________________________"""
+
+    def __init__(self, codes, states, score='bic', equivalent_sample_size=10, n_jobs=1):
+        self.codes = codes
+        self.cardinalities = {variable: len(variable_states) for variable, variable_states in states.items()}
+        self.score = score
+        self.equivalent_sample_size = equivalent_sample_size
+        self.n_jobs = n_jobs
+        self.table = {}
+        self._executor = None
+
+    def get(self, node, parents):
+        key = (node, tuple(sorted(parents)))
+        if key not in self.table:
+            self.table[key] = _score_family(self.codes, self.cardinalities, key, self.score,
+                                            self.equivalent_sample_size)
+        return self.table[key]
+
+    def prefetch(self, families):
+        #  Scores every (node, parents) of 'families' that is not cached yet.
+        missing = list(dict.fromkeys((node, tuple(sorted(parents))) for node, parents in families))
+        missing = [key for key in missing if key not in self.table]
+        if self.n_jobs <= 1 or len(missing) < 2 * self.n_jobs:
+            for node, parents in missing:
+                self.get(node, parents)
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.n_jobs, initializer=_init_worker,
+                                                 initargs=(self.codes, self.cardinalities, self.score,
+                                                           self.equivalent_sample_size))
+        chunksize = max(1, len(missing) // (4 * self.n_jobs))
+        self.table.update(zip(missing, self._executor.map(_worker_score, missing, chunksize=chunksize)))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def hill_climb(data_frame, variables, score='bic', equivalent_sample_size=10, max_parents=3, start_edges=(),
+               required_edges=(), forbidden_edges=(), tabu_length=0, max_iterations=1000, epsilon=1e-4, n_jobs=1):
+    """                                 FUNCTION hill_climb
+       __________________________________________________________________________________________
+         Greedy search over DAGs on 'variables' (columns of 'data_frame') which applies, at every
+         step, the edge addition, removal or reversal that increases the score the most, until
+         no move increases it by more than 'epsilon'.  Returns (edges, score).
+
+         max_parents        -   The largest number of parents a node may get.
+         start_edges        -   The DAG to start from, e.g. a hand-written EDGES list.
+         required_edges     -   Edges that are added first and never removed nor reversed.  A
+                                ValueError is raised if they close a cycle, give a node more
+                                than max_parents parents or are also forbidden.
+         forbidden_edges    -   Edges that are never added.
+         tabu_length        -   With tabu_length > 0 the last tabu_length moves may not be undone,
+                                which keeps the search from cycling between two DAGs.
+         n_jobs             -   The number of processes scoring new families.
+
+         Only nodes with at least one edge appear in the edge list, make_bn cannot build an
+         isolated node.
+       __________________________________________________________________________________________"""
+    variables = list(variables)
+    required = set(required_edges)
+    forbidden = set(forbidden_edges)
+    parents = {variable: set() for variable in variables}
+    if required & forbidden:
+        raise ValueError(f'Edges are both required and forbidden : {sorted(required & forbidden)}')
+    for parent, child in dict.fromkeys(required_edges):
+        if _reaches(parents, parent, child):
+            raise ValueError(f'The required edge {(parent, child)} closes a cycle with the other required edges')
+        parents[child].add(parent)
+        if len(parents[child]) > max_parents:
+            raise ValueError(f'{child} has more than max_parents = {max_parents} required parents')
+    #  Start edges are only a starting point, those that would close a cycle are skipped.
+    for parent, child in start_edges:
+        if (parent, child) not in required and not _reaches(parents, parent, child):
+            parents[child].add(parent)
+
+    codes, states = encode_columns(data_frame, variables)
+    scores = FamilyScores(codes, states, score, equivalent_sample_size, n_jobs)
+
+    tabu = []
+    try:
+        for _ in range(max_iterations):
+            moves = _legal_moves(parents, variables, max_parents, required, forbidden, tabu)
+            scores.prefetch(family for move in moves for family in _new_families(parents, move))
+            best_move, best_delta = None, epsilon
+            for move in moves:
+                delta = sum(scores.get(node, new_parents) - scores.get(node, parents[node])
+                            for node, new_parents in _new_families(parents, move))
+                if delta > best_delta:
+                    best_move, best_delta = move, delta
+            if best_move is None:
+                break
+            for node, new_parents in _new_families(parents, best_move):
+                parents[node] = set(new_parents)
+            if tabu_length > 0:
+                tabu = (tabu + [_undo(best_move)])[-tabu_length:]
+        total = sum(scores.get(variable, parents[variable]) for variable in variables)
+    finally:
+        scores.close()
+    edges = [(parent, child) for child in variables for parent in sorted(parents[child])]
+    return edges, total
+
+
+def _legal_moves(parents, variables, max_parents, required, forbidden, tabu):
+    #  Every ('add' | 'remove' | 'reverse', parent, child) that keeps the graph acyclic and respects the constraints.
+    moves = []
+    for child in variables:
+        for parent in variables:
+            if parent == child:
+                continue
+            edge = (parent, child)
+            if parent in parents[child]:
+                if edge in required:
+                    continue
+                moves.append(('remove', parent, child))
+                #  Reversing u -> v creates a cycle if v reaches u by another path.
+                if (child, parent) not in forbidden and len(parents[parent]) < max_parents \
+                        and not _reaches(parents, child, parent, skip_edge=edge):
+                    moves.append(('reverse', parent, child))
+            elif edge not in forbidden and len(parents[child]) < max_parents and not _reaches(parents, parent, child):
+                moves.append(('add', parent, child))
+    return [move for move in moves if move not in tabu]
+
+
+def _reaches(parents, start, goal, skip_edge=None):
+    #  True if adding start -> goal would close a cycle, i.e. if 'goal' is an ancestor of 'start'.
+    stack = [start]
+    seen = set()
+    while stack:
+        node = stack.pop()
+        if node == goal:
+            return True
+        if node in seen:
+            continue
+        seen.add(node)
+        stack.extend(parent for parent in parents[node] if (parent, node) != skip_edge)
+    return False
+
+
+def _new_families(parents, move):
+    #  The (node, new parents) pairs whose families 'move' changes.
+    kind, parent, child = move
+    if kind == 'add':
+        return [(child, parents[child] | {parent})]
+    if kind == 'remove':
+        return [(child, parents[child] - {parent})]
+    return [(child, parents[child] - {parent}), (parent, parents[parent] | {child})]
+
+
+def _undo(move):
+    kind, parent, child = move
+    if kind == 'add':
+        return 'remove', parent, child
+    if kind == 'remove':
+        return 'add', parent, child
+    return 'reverse', child, parent
+
+
+def _score_family(codes, cardinalities, key, score, equivalent_sample_size):
+    node, parents = key
+    family = [node] + list(parents)
+    counts = count_configurations([codes[variable] for variable in family],
+                                  [cardinalities[variable] for variable in family])
+    return family_score(counts, score, equivalent_sample_size)
+
+
+def _init_worker(codes, cardinalities, score, equivalent_sample_size):
+    _worker['arguments'] = (codes, cardinalities)
+    _worker['score'] = (score, equivalent_sample_size)
+
+
+def _worker_score(key):
+    return _score_family(*_worker['arguments'], key, *_worker['score'])
+
+
+if __name__ == '__main__':
+    from data_loader import load_compact
+
+    parser = argparse.ArgumentParser(description='Learns the edge list of a network from data.')
+    parser.add_argument('data', help='the .csv or .parquet file')
+    parser.add_argument('variables', nargs='+', help='the columns to use as nodes')
+    parser.add_argument('--score', choices=['bic', 'bdeu'], default='bic')
+    parser.add_argument('--equivalent-sample-size', type=float, default=10)
+    parser.add_argument('--max-parents', type=int, default=3)
+    parser.add_argument('--tabu-length', type=int, default=0)
+    parser.add_argument('--n-jobs', type=int, default=1)
+    parser.add_argument('--output', help='write the edges to this JSON file, e.g. for scoring_service.py')
+    arguments = parser.parse_args()
+
+    df, _ = load_compact(arguments.data, arguments.variables, passthrough=())
+    learned_edges, learned_score = hill_climb(df, arguments.variables, arguments.score,
+                                              arguments.equivalent_sample_size, arguments.max_parents,
+                                              tabu_length=arguments.tabu_length, n_jobs=arguments.n_jobs)
+    print(f'Score : {learned_score}')
+    print(f'EDGES = {learned_edges}')
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as file:
+            json.dump(learned_edges, file)
@@ -0,0 +1,126 @@
+"""
+Sufficient statistics for K-fold CPT construction.
+
+Instead of re-scanning (K-1)/K of the data for every node of every fold's network,
+we scan the data once and build, for every node, an integer count tensor over the
+node's family (the node and its parents) with one slice per test fold.  Since the
+folds partition the sample, the counts of the whole sample are the sum of those
+slices and the training counts of fold i are simply total - fold_i.
+"""
+
+import numpy as np
+import pandas as pd
+
+from cpdmaker import count_configurations, cpd_from_counts
+from data_loader import DEFAULT_CHUNKSIZE, category_codes, read_chunks, scan_states
+from instrumentation import timer
+
+
+def encode_columns(data_frame: pd.DataFrame, variables):
+    """                                 FUNCTION encode_columns
+       __________________________________________________________________________________________
+         Returns a pair (codes, states).  'states' maps each variable to the sorted list of its
+         states, and 'codes' maps each variable to an integer array holding, for every row of
+         'data_frame', the index of that row's state in 'states'.  This is the same
+         lexicographic convention used by 'state_mapping' and 'make_cpd'.  Categorical columns
+         with sorted categories (see data_loader.py) are used as they are.
+
+         data_frame         -   A DataFrame object which contains the variables.
+         variables          -   An iterable of column names of 'data_frame'.
+       __________________________________________________________________________________________"""
+    codes = {}
+    states = {}
+    for variable in variables:
+        column = data_frame[variable]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            #  Columns from data_loader.load_compact are already coded in sorted state order.
+            states[variable] = list(column.cat.categories)
+            codes[variable] = column.cat.codes.to_numpy()
+        else:
+            states[variable] = sorted(column.unique())
+            codes[variable] = pd.Categorical(column, categories=states[variable]).codes
+    return codes, states
+
+
+def fold_family_counts(codes, states, nodes, parents_of_node, fold_ids, num_folds, instruments=None):
+    """                                 FUNCTION fold_family_counts
+       __________________________________________________________________________________________
+         Builds the count tensor of every node's family in a single pass over the rows.  The
+         ith returned array has shape (num_folds, card_node, card_parent_1, ..., card_parent_n)
+         and its slice [k] holds the family counts of the rows of fold k.  Rows whose fold id
+         is negative (not part of the sample) are ignored.
+
+         codes, states      -   The output of 'encode_columns'.
+         nodes              -   The nodes of the network.
+         parents_of_node    -   The ith element is the ordered list of parents of nodes[i].
+         fold_ids           -   An integer array giving the test fold of every row.
+         num_folds          -   The number of folds, K.
+         instruments        -   An optional Instrumentation, the counting of every node's
+                                family is timed as 'cpt_counts/<node>'.
+       __________________________________________________________________________________________"""
+    fold_ids = np.asarray(fold_ids)
+    in_sample = fold_ids >= 0
+    fold_ids = fold_ids[in_sample]
+    family_counts = []
+    for node, parents in zip(nodes, parents_of_node):
+        family = [node] + list(parents)
+        code_columns = [fold_ids] + [codes[variable][in_sample] for variable in family]
+        cardinalities = [num_folds] + [len(states[variable]) for variable in family]
+        with timer(instruments, f'cpt_counts/{node}'):
+            family_counts.append(count_configurations(code_columns, cardinalities))
+    return family_counts
+
+
+def stream_family_counts(path, nodes, parents_of_node, fold_column=None, row_filter=None,
+                         chunksize=DEFAULT_CHUNKSIZE):
+    """                                 FUNCTION stream_family_counts
+       __________________________________________________________________________________________
+         The out-of-core counterpart of encode_columns + fold_family_counts.  The file at 'path'
+         (.csv or .parquet) is read twice in chunks: once to find the sorted states of every node
+         and once to add each chunk's family counts into dense tensors.  Memory is therefore
+         bounded by the size of the CPTs, not by the number of rows.  Returns (states,
+         family_counts) in the same format as encode_columns and fold_family_counts.
+
+         fold_column        -   Optional name of a column holding the test fold (0, ..., K-1) of
+                                every row, rows with a negative fold are ignored.  Without it
+                                every row is counted in a single fold.
+         row_filter         -   As in data_loader.load_compact, applied to both passes.
+       __________________________________________________________________________________________"""
+    columns = list(nodes) + ([fold_column] if fold_column is not None else [])
+    states = scan_states(path, columns, row_filter=row_filter, chunksize=chunksize)
+    num_folds = int(max(states[fold_column])) + 1 if fold_column is not None else 1
+    families = [[node] + list(parents) for node, parents in zip(nodes, parents_of_node)]
+    family_counts = [np.zeros([num_folds] + [len(states[variable]) for variable in family], dtype=np.int64)
+                     for family in families]
+
+    for chunk in read_chunks(path, columns, chunksize):
+        if row_filter is not None:
+            chunk = chunk.loc[row_filter(chunk)]
+        if chunk.empty:
+            continue
+        if fold_column is not None:
+            fold_ids = chunk[fold_column].to_numpy(dtype=np.int64)
+            chunk = chunk.loc[fold_ids >= 0]
+            fold_ids = fold_ids[fold_ids >= 0]
+        else:
+            fold_ids = np.zeros(len(chunk), dtype=np.int64)
+        codes = {node: category_codes(chunk[node], states[node]) for node in nodes}
+        for counts, family in zip(family_counts, families):
+            counts += count_configurations([fold_ids] + [codes[variable] for variable in family], counts.shape)
+    return {node: states[node] for node in nodes}, family_counts
+
+
+def fold_ids_from_indexes(test_grp_indexes, num_rows):
+    """ Returns an array of length num_rows whose jth entry is the test fold containing row j, or -1. """
+    fold_ids = np.full(num_rows, -1, dtype=np.int64)
+    for i, indexes in enumerate(test_grp_indexes):
+        fold_ids[np.asarray(indexes, dtype=np.int64)] = i
+    return fold_ids
+
+
+def training_cpds(family_counts, fold, pseudocount=0):
+    """
+    Returns the CPTs (one per node, in the layout TabularCPD expects) of the training group
+    associated with test fold 'fold', computed as (total counts - fold counts).
+    """
+    return [cpd_from_counts(counts.sum(axis=0) - counts[fold], pseudocount) for counts in family_counts]
@@ -0,0 +1,18 @@
+"""
+Checks that every method of fast_query gives the posteriors of the original 'deepcopy' method, on
+synthetic data (see benchmarks/synthetic.py) with enough missing values that the compiled methods
+also fall back to querying.
+
+usage : python -m pytest test_benchmark_query.py
+"""
+import pytest
+
+from benchmark_query import METHODS, differing_methods, run_benchmark
+from benchmarks.synthetic import generate
+
+
+@pytest.mark.parametrize('missing_rate', [.05, .3])
+def test_posteriors_are_unchanged(missing_rate):
+    results = run_benchmark(generate(400, missing_rate=missing_rate, seed=1), 400)
+    assert list(results) == METHODS
+    assert differing_methods(results) == []
@@ -0,0 +1,71 @@
+"""
+Checks RiskScorer through LocalClient, on a network trained on synthetic data (see benchmarks/synthetic.py).
+
+usage : python -m pytest test_scoring_service.py
+"""
+import io
+import json
+
+import numpy as np
+import pytest
+from pgmpy.inference import VariableElimination
+
+from benchmarks.synthetic import DEFAULT_EDGES, TARGET_VARIABLE, write
+from scoring_service import LocalClient, RiskScorer, serve_lines
+
+NUM_ROWS = 2000
+
+
+@pytest.fixture(scope='module')
+def trained(tmp_path_factory):
+    #  The scorer and the synthetic rows it was trained on.
+    path = tmp_path_factory.mktemp('data') / 'synthetic.csv'
+    data_frame = write(path, NUM_ROWS, seed=3)
+    return RiskScorer.from_file(path, DEFAULT_EDGES, TARGET_VARIABLE), data_frame
+
+
+def test_predictions_match_variable_elimination(trained):
+    scorer, data_frame = trained
+    rows = data_frame.head(50).to_dict(orient='records')
+    results = LocalClient(scorer).score(rows)['results']
+
+    inference = VariableElimination(scorer.bn)
+    for row, result in zip(rows, results):
+        evidence = {variable: scorer.env_map[variable][row[variable]] for variable in scorer.environment_variables
+                    if str(row[variable]) != 'N'}
+        expected = inference.query([TARGET_VARIABLE], evidence, show_progress=False).values[1]
+        assert result['ID'] == row['ID']
+        assert result['prediction'] == pytest.approx(expected, abs=1e-9)
+        assert result['tier'] in ('high', 'moderate', 'low')
+
+
+def test_bad_requests_are_answered_with_an_error(trained):
+    scorer, data_frame = trained
+    client = LocalClient(scorer)
+    row = data_frame.iloc[0].to_dict()
+
+    unseen = dict(row, Product='never seen')
+    assert client.score([unseen])['results'][0]['tier'] == 'error'
+    assert 'error' in client.score([{'ID': 1}])
+    assert 'error' in client.score('not a list of rows')
+    assert client.score([row])['results'][0]['tier'] != 'error'
+
+
+def test_serve_lines_survives_a_bad_request(trained):
+    scorer, data_frame = trained
+    row = json.loads(data_frame.head(1).to_json(orient='records'))[0]
+    requests = [{'rows': 'not a list of rows'}, {'rows': [row]}, {'command': 'stats'}]
+    output = io.StringIO()
+    serve_lines(scorer, io.StringIO('\n'.join(json.dumps(request) for request in requests) + '\n'), output)
+
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert 'error' in responses[0]
+    assert responses[1]['results'][0]['ID'] == row['ID']
+    assert responses[2]['requests'] >= 1
+
+
+def test_states_are_required_for_a_pgmpy_network(trained):
+    scorer, _ = trained
+    with pytest.raises(ValueError):
+        RiskScorer(scorer.bn, TARGET_VARIABLE)
+    assert np.isfinite(scorer.stats()['rows_per_second'])